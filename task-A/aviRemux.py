@@ -0,0 +1,134 @@
+import os
+import struct
+
+# Largest output written by the remuxer. Plain AVI (without the OpenDML extension) is only
+# reliably readable up to 1 GB, so larger jobs go through the decode path instead
+MAX_AVI_SIZE = 1 << 30
+
+AVIF_HASINDEX = 0x10
+AVIIF_KEYFRAME = 0x10
+
+# Reads the stream headers and the position of every video frame of an MJPG AVI file
+# without reading the frame data. Returns None if the file is not a single-stream MJPG AVI
+def read_avi_index(file_path):
+    try:
+        avi = open(file_path, "rb")
+    except OSError:
+        return None
+
+    info = {"path": file_path, "frames": [], "streams": 0}
+    with avi:
+        file_size = os.fstat(avi.fileno()).st_size
+        _walk_chunks(avi, file_size, info)
+
+    # Only single-stream MJPG video can be copied frame by frame
+    if "width" not in info or info["streams"] != 1 or info.get("codec") != b"MJPG":
+        return None
+    return info
+
+# Walks the RIFF chunk tree, collecting headers and frame chunk positions into info
+def _walk_chunks(avi, end, info):
+    while avi.tell() + 8 <= end:
+        header = avi.read(8)
+        if len(header) < 8:
+            break
+        chunk_id, size = struct.unpack("<4sI", header)
+        data_start = avi.tell()
+
+        if chunk_id in (b"RIFF", b"LIST"):
+            # Descends into AVI/AVIX files and the hdrl, strl, movi and rec lists
+            avi.read(4)
+            _walk_chunks(avi, min(end, data_start + size), info)
+        elif chunk_id == b"avih":
+            avih = struct.unpack("<10I", avi.read(40))
+            info["width"], info["height"] = avih[8], avih[9]
+        elif chunk_id == b"strh":
+            strh = avi.read(size)
+            info["streams"] += 1
+            info["scale"], info["rate"] = struct.unpack("<2I", strh[20:28])
+        elif chunk_id == b"strf":
+            # BITMAPINFOHEADER: the width, height and compression of the video stream
+            strf = avi.read(size)
+            info["width"], info["height"] = struct.unpack("<2i", strf[4:12])
+            info["height"] = abs(info["height"])
+            info["codec"] = strf[16:20]
+        elif chunk_id[:2] == b"00" and chunk_id[2:] in (b"dc", b"db"):
+            info["frames"].append((data_start, size))
+
+        # Chunks are padded to an even size
+        avi.seek(data_start + size + (size & 1))
+
+# Checks whether MJPG AVI files can be joined without decoding: same frame size and frame rate
+def avi_compatible(infos):
+    if any(info is None for info in infos):
+        return False
+    first = infos[0]
+    for info in infos[1:]:
+        if (info["width"], info["height"]) != (first["width"], first["height"]):
+            return False
+        if info["rate"] * first["scale"] != first["rate"] * info["scale"]:
+            return False
+    return True
+
+# Checks whether the joined files stay below the plain AVI size limit
+def fits_plain_avi(infos):
+    movi_size = sum(8 + size + (size & 1) for info in infos for _, size in info["frames"])
+    index_size = sum(16 * len(info["frames"]) for info in infos)
+    return movi_size + index_size + 1024 <= MAX_AVI_SIZE
+
+# Concatenates compatible MJPG AVI files by copying the compressed frames into a new AVI file
+# and returns the number of frames written
+def remux_avi(infos, output_path):
+    frames = [(info["path"], position, size) for info in infos for position, size in info["frames"]]
+    movi_size = 4 + sum(8 + size + (size & 1) for _, _, size in frames)
+    index_size = 16 * len(frames)
+
+    first = infos[0]
+    width, height = first["width"], first["height"]
+    scale, rate = first["scale"], first["rate"]
+    largest_frame = max((size for _, _, size in frames), default=0)
+
+    # avih: main header
+    avih = struct.pack("<10I4I", int(1e6 * scale / rate), 0, 0, AVIF_HASINDEX, len(frames), 0, 1,
+                       largest_frame, width, height, 0, 0, 0, 0)
+    # strh: video stream header
+    strh = struct.pack("<4s4sIHHIIIIIIIIhhhh", b"vids", b"MJPG", 0, 0, 0, 0, scale, rate, 0, len(frames),
+                       largest_frame, 0xFFFFFFFF, 0, 0, 0, width, height)
+    # strf: BITMAPINFOHEADER
+    strf = struct.pack("<IiiHH4sIiiII", 40, width, height, 1, 24, b"MJPG", width * height * 3, 0, 0, 0, 0)
+    strl = b"strl" + _chunk(b"strh", strh) + _chunk(b"strf", strf)
+    hdrl = b"hdrl" + _chunk(b"avih", avih) + _chunk(b"LIST", strl)
+    riff_size = 4 + 8 + len(hdrl) + 8 + movi_size + 8 + index_size
+
+    index = bytearray()
+    with open(output_path, "wb") as out:
+        out.write(struct.pack("<4sI4s", b"RIFF", riff_size, b"AVI "))
+        out.write(_chunk(b"LIST", hdrl))
+        out.write(struct.pack("<4sI4s", b"LIST", movi_size, b"movi"))
+
+        # Copies the frames file by file, indexing them relative to the "movi" fourcc
+        offset = 4
+        sources = {}
+        for path, position, size in frames:
+            if path not in sources:
+                sources[path] = open(path, "rb")
+            source = sources[path]
+            source.seek(position)
+            data = source.read(size)
+            out.write(struct.pack("<4sI", b"00dc", size))
+            out.write(data)
+            if size & 1:
+                out.write(b"\0")
+            index += struct.pack("<4sIII", b"00dc", AVIIF_KEYFRAME, offset, size)
+            offset += 8 + size + (size & 1)
+        for source in sources.values():
+            source.close()
+
+        out.write(struct.pack("<4sI", b"idx1", index_size))
+        out.write(index)
+    return len(frames)
+
+# Builds a RIFF chunk from an id and its data
+def _chunk(chunk_id, data):
+    padding = b"\0" if len(data) & 1 else b""
+    return struct.pack("<4sI", chunk_id, len(data)) + data + padding
@@ -0,0 +1,174 @@
+import argparse
+import contextlib
+import glob
+import json
+import multiprocessing as mp
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Runs a manifest of jobs without any prompts, e.g.
+# python task-A/batch.py jobs.json --workers 4 --retries 1 --log-dir logs --report report.json
+#
+# The manifest is a JSON file. Every job names an input video and the pipeline.py options to use,
+# written with their long option names (dashes or underscores), e.g.
+#
+#   {
+#     "defaults": {"watermark": "task-A/project-files-A/watermark1.png", "preset": "mp4v"},
+#     "inputs": ["videos/*.mp4"],
+#     "jobs": [
+#       {"input": "task-A/project-files-A/office.mp4", "output": "office.avi", "blur": true, "detect_every": 5},
+#       {"input": "task-A/project-files-A/singapore.mp4", "night": true, "append": "task-A/project-files-A/endscreen.mp4"}
+#     ]
+#   }
+#
+# "defaults" apply to every job, "inputs" are glob patterns that each add a job with the defaults only,
+# and a missing "output" is the input file name with an .avi extension.
+
+# Loads the manifest and expands it into a list of jobs
+def load_manifest(manifest_path):
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    defaults = manifest.get("defaults", {})
+    jobs = [dict(defaults, **job) for job in manifest.get("jobs", [])]
+    for pattern in manifest.get("inputs", []):
+        for input_path in sorted(glob.glob(pattern)):
+            jobs.append(dict(defaults, input=input_path))
+
+    for job in jobs:
+        if "output" not in job:
+            job["output"] = os.path.splitext(os.path.basename(job["input"]))[0] + ".avi"
+    return jobs
+
+# Turns a job into pipeline.py command line arguments
+def job_to_argv(job):
+    argv = [job["input"], job["output"]]
+    for key, value in job.items():
+        if key in ("input", "output") or value is None or value is False:
+            continue
+        option = "--" + key.replace("_", "-")
+        if value is True:
+            argv.append(option)
+        elif isinstance(value, (list, tuple)):
+            argv.append(option)
+            argv.append("x".join(str(item) for item in value))
+        else:
+            argv.extend([option, str(value)])
+    return argv
+
+# Runs one job in a worker process, with its output going to a log file if log_dir is given
+def run_job(job, log_dir=None, attempt=1):
+    from pipeline import build_parser, run_from_args
+
+    start_time = time.perf_counter()
+    result = {"frames": None, "error": None}
+    log_file = None
+    if log_dir is not None:
+        log_name = os.path.splitext(job["output"])[0] + f"_attempt{attempt}.log"
+        log_file = open(os.path.join(log_dir, log_name), "w")
+
+    with contextlib.ExitStack() as stack:
+        if log_file is not None:
+            stack.enter_context(log_file)
+            stack.enter_context(contextlib.redirect_stdout(log_file))
+            stack.enter_context(contextlib.redirect_stderr(log_file))
+        try:
+            args = build_parser().parse_args(job_to_argv(job))
+            result["frames"] = run_from_args(args)
+            if result["frames"] is None:
+                result["error"] = "processing failed, see the job output"
+        except SystemExit:
+            # argparse exits on options that do not exist or have invalid values
+            result["error"] = "invalid job options"
+        except Exception as error:
+            traceback.print_exc()
+            result["error"] = f"{type(error).__name__}: {error}"
+
+    result["seconds"] = time.perf_counter() - start_time
+    return result
+
+# Runs the jobs on a bounded pool of worker processes, retrying failed jobs up to retries times
+# Returns one summary entry per job
+def run_batch(jobs, workers=2, retries=0, log_dir=None):
+    if log_dir is not None:
+        os.makedirs(log_dir, exist_ok=True)
+
+    summary = [{"input": job["input"], "output": job["output"], "status": "pending", "attempts": 0,
+                "frames": None, "seconds": 0.0, "error": None} for job in jobs]
+    finished = 0
+    print(f"Running {len(jobs)} job(s) on {workers} worker(s)...\n")
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as executor:
+        pending = {}
+        for job_index, job in enumerate(jobs):
+            summary[job_index]["attempts"] = 1
+            pending[executor.submit(run_job, job, log_dir, 1)] = job_index
+
+        while pending:
+            future = next(as_completed(pending))
+            job_index = pending.pop(future)
+            entry = summary[job_index]
+            try:
+                result = future.result()
+            except Exception as error:
+                # The worker process itself died
+                result = {"frames": None, "seconds": 0.0, "error": f"{type(error).__name__}: {error}"}
+            entry["seconds"] += result["seconds"]
+            entry["frames"] = result["frames"]
+            entry["error"] = result["error"]
+
+            # Invalid options fail the same way every time, so only processing failures are retried
+            retryable = result["error"] is not None and result["error"] != "invalid job options"
+            if retryable and entry["attempts"] <= retries:
+                print(f"Job {entry['input']} failed ({result['error']}), retrying...")
+                entry["attempts"] += 1
+                pending[executor.submit(run_job, jobs[job_index], log_dir, entry["attempts"])] = job_index
+                continue
+
+            finished += 1
+            entry["status"] = "failed" if result["error"] is not None else "done"
+            details = result["error"] if result["error"] is not None else f"{result['frames']} frames"
+            print(f"[{finished}/{len(jobs)}] {entry['input']} -> {entry['output']}: {entry['status']} "
+                  f"({details}, {result['seconds']:.1f} s)")
+
+    print_summary(summary)
+    return summary
+
+# Prints how many jobs succeeded and lists the failed ones
+def print_summary(summary):
+    done = [entry for entry in summary if entry["status"] == "done"]
+    failed = [entry for entry in summary if entry["status"] != "done"]
+    total_seconds = sum(entry["seconds"] for entry in summary)
+    total_frames = sum(entry["frames"] or 0 for entry in done)
+    print(f"\nBatch complete: {len(done)} done, {len(failed)} failed, "
+          f"{total_frames} frames in {total_seconds:.1f} s of job time.")
+    for entry in failed:
+        print(f"  FAILED {entry['input']} after {entry['attempts']} attempt(s): {entry['error']}")
+
+# Command line entry point
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process many videos from a JSON manifest without prompts.")
+    parser.add_argument("manifest", help="JSON manifest of jobs")
+    parser.add_argument("--workers", type=int, default=2, help="number of jobs running at the same time")
+    parser.add_argument("--retries", type=int, default=0, help="times to retry a failed job")
+    parser.add_argument("--log-dir", default=None, help="write the output of each job to a log file here")
+    parser.add_argument("--report", default=None, help="write the summary of every job to this JSON file")
+    parser.add_argument("--profile-dir", default=None,
+                        help="profile every job and save its run report here (a job can also set \"profile\")")
+    args = parser.parse_args(argv)
+
+    jobs = load_manifest(args.manifest)
+    if args.profile_dir is not None:
+        os.makedirs(args.profile_dir, exist_ok=True)
+        for job in jobs:
+            job.setdefault("profile", os.path.join(args.profile_dir, os.path.splitext(job["output"])[0] + ".json"))
+    summary = run_batch(jobs, args.workers, args.retries, args.log_dir)
+    if args.report is not None:
+        with open(args.report, "w") as report_file:
+            json.dump(summary, report_file, indent=2)
+        print(f"Report saved to {args.report}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing as mp
+import os
+import platform
+import shutil
+import string
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from pipeline import parse_resolution
+
+# Benchmarks every task-A and task-B operation on synthetic inputs over a grid of sizes, e.g.
+# python task-A/benchmark.py --save bench.json
+# python task-A/benchmark.py --compare bench.json --tolerance 0.15
+#
+# Inputs are generated in a temporary workspace laid out like the repository, so the operations
+# write their outputs there and nothing in the repository changes. Every case runs in a fresh process,
+# which makes the peak memory of one case independent of the others.
+
+TASK_A_DIR = os.path.dirname(os.path.abspath(__file__))
+TASK_B_DIR = os.path.join(TASK_A_DIR, "..", "task-B")
+
+VIDEO_OPERATIONS = ("detect_night", "blur_faces", "overlay_video", "add_watermark", "stitching",
+                    "stitching_resample")
+PAGE_OPERATIONS = ("extract_paragraphs",)
+OPERATIONS = VIDEO_OPERATIONS + PAGE_OPERATIONS
+
+# Writes an MJPG AVI clip of a dark (night) or bright scene with face-like patterns moving across it
+def make_synthetic_video(path, width, height, frame_count, fps=25, night=False, faces=2, seed=0):
+    rng = np.random.default_rng(seed)
+    level = 50 if night else 170
+
+    # Static background: a vertical gradient with sensor-like noise
+    gradient = np.linspace(-30, 30, height, dtype=np.float32)[:, None, None]
+    noise = rng.normal(0, 8, (height, width, 3)).astype(np.float32)
+    background = np.clip(level + gradient + noise, 0, 255).astype(np.uint8)
+
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    if not out.isOpened():
+        print(f"Error: Cannot create synthetic video {path}")
+        return None
+
+    # Faces bounce around the frame at a constant speed
+    face_size = max(24, height // 5)
+    positions = rng.uniform([face_size, face_size], [width - face_size, height - face_size], (faces, 2))
+    velocities = rng.uniform(-0.01, 0.01, (faces, 2)) * [width, height]
+    for _ in range(frame_count):
+        frame = background.copy()
+        for face_index in range(faces):
+            positions[face_index] += velocities[face_index]
+            for axis, limit in enumerate((width, height)):
+                if not face_size <= positions[face_index][axis] <= limit - face_size:
+                    velocities[face_index][axis] *= -1
+            draw_face(frame, int(positions[face_index][0]), int(positions[face_index][1]), face_size, level / 170)
+        out.write(frame)
+    out.release()
+    return path
+
+# Draws a simple face (skin-coloured oval, eyebrows, eyes and mouth) centred on (x, y)
+def draw_face(frame, x, y, size, light=1.0):
+    skin = tuple(int(channel * light) for channel in (140, 170, 215))
+    dark = tuple(int(channel * light) for channel in (30, 30, 40))
+    cv2.ellipse(frame, (x, y), (size // 2, int(size * 0.65)), 0, 0, 360, skin, -1)
+    for side in (-1, 1):
+        eye = (x + side * size // 5, y - size // 6)
+        cv2.circle(frame, eye, max(2, size // 12), dark, -1)
+        cv2.line(frame, (eye[0] - size // 10, eye[1] - size // 8), (eye[0] + size // 10, eye[1] - size // 8), dark,
+                 max(1, size // 40))
+    cv2.ellipse(frame, (x, y + size // 4), (size // 6, size // 16), 0, 0, 360, dark, -1)
+
+# Writes a semi-transparent PNG watermark
+def make_synthetic_watermark(path, width=300, height=100):
+    watermark = np.zeros((height, width, 4), dtype=np.uint8)
+    cv2.putText(watermark, "BENCH", (10, int(height * 0.75)), cv2.FONT_HERSHEY_SIMPLEX, height / 40,
+                (255, 255, 255, 160), max(2, height // 20))
+    cv2.imwrite(path, watermark)
+    return path
+
+# Writes a grayscale page of columns of text paragraphs with a full-width table in the middle
+def make_synthetic_page(path, width, height, columns=2, table=True, seed=0):
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width), 255, dtype=np.uint8)
+    margin = width // 12
+    gutter = width // 16
+    column_width = (width - 2 * margin - (columns - 1) * gutter) // columns
+
+    # Text lines a little closer than the 30 pixel paragraph gap of task-B, paragraphs further apart
+    line_height = max(10, min(26, height // 100))
+    line_step = line_height + line_height // 2
+    paragraph_gap = max(45, 3 * line_height)
+    font_scale = cv2.getFontScaleFromHeight(cv2.FONT_HERSHEY_SIMPLEX, line_height)
+    char_width = cv2.getTextSize("n", cv2.FONT_HERSHEY_SIMPLEX, font_scale, 1)[0][0]
+
+    # The table is a band of ruled rows across almost the whole width
+    bands = [(margin, height - margin)]
+    if table:
+        table_top, table_bottom = int(height * 0.45), int(height * 0.6)
+        bands = [(margin, table_top - paragraph_gap), (table_bottom + paragraph_gap, height - margin)]
+        for y in range(table_top, table_bottom + 1, max(12, (table_bottom - table_top) // 6)):
+            cv2.line(page, (width // 20, y), (width - width // 20, y), 0, 3)
+        for x in np.linspace(width // 20, width - width // 20, 5).astype(int):
+            cv2.line(page, (int(x), table_top), (int(x), table_bottom), 0, 2)
+        # The last ruled row survives remove_table, so the table breaks at the gutters to keep the columns apart
+        for column in range(1, columns):
+            gutter_centre = margin + column * (column_width + gutter) - gutter // 2
+            page[table_top - 2:table_bottom + 3, gutter_centre - 3:gutter_centre + 4] = 255
+
+    for column in range(columns):
+        left = margin + column * (column_width + gutter)
+        for top, bottom in bands:
+            y = top + line_height
+            while y < bottom:
+                # A paragraph of 3 to 8 lines of random words
+                for _ in range(rng.integers(3, 9)):
+                    if y >= bottom:
+                        break
+                    words = []
+                    while (len(" ".join(words)) + 10) * char_width * 0.8 < column_width:
+                        words.append("".join(rng.choice(list(string.ascii_lowercase), rng.integers(2, 10))))
+                    cv2.putText(page, " ".join(words), (left, y), cv2.FONT_HERSHEY_SIMPLEX, font_scale, 0, 1,
+                                cv2.LINE_AA)
+                    y += line_step
+                y += paragraph_gap
+    cv2.imwrite(path, page)
+    return path
+
+# Creates the workspace layout the operations expect and generates every input in it
+# Returns a dictionary of input paths for each case
+def prepare_workspace(work_dir, sizes, frame_count, fps, page_sizes, pages):
+    os.makedirs(os.path.join(work_dir, "task-A", "processed-files-A"), exist_ok=True)
+    os.makedirs(os.path.join(work_dir, "task-B", "paragraphs"), exist_ok=True)
+    os.makedirs(os.path.join(work_dir, "inputs"), exist_ok=True)
+    shutil.copy(os.path.join(TASK_A_DIR, "face_detector.xml"), os.path.join(work_dir, "task-A", "face_detector.xml"))
+
+    inputs = {"watermark": make_synthetic_watermark(os.path.join(work_dir, "inputs", "watermark.png")),
+              "overlay": make_synthetic_video(os.path.join(work_dir, "inputs", "overlay.avi"), 320, 180, 30, fps,
+                                              faces=1, seed=1),
+              # A smaller clip at another frame rate, so stitching it on has to decode, resize and resample
+              "endscreen": make_synthetic_video(os.path.join(work_dir, "inputs", "endscreen.avi"), 320, 180,
+                                                frame_count, fps * 1.2, faces=1, seed=2)}
+    for width, height in sizes:
+        size = f"{width}x{height}"
+        print(f"Generating {frame_count} frame clips at {size}...")
+        inputs[f"night {size}"] = make_synthetic_video(os.path.join(work_dir, "inputs", f"night_{size}.avi"),
+                                                       width, height, frame_count, fps, night=True)
+        inputs[f"day {size}"] = make_synthetic_video(os.path.join(work_dir, "inputs", f"day_{size}.avi"),
+                                                     width, height, frame_count, fps)
+    for width, height in page_sizes:
+        size = f"{width}x{height}"
+        print(f"Generating {pages} pages at {size}...")
+        inputs[f"pages {size}"] = [make_synthetic_page(os.path.join(work_dir, "inputs", f"page_{size}_{page}.png"),
+                                                       width, height, columns=2 + page % 2, seed=page)
+                                   for page in range(pages)]
+    return inputs
+
+# Runs one operation in the workspace and returns its profile report (see instrument.py)
+def run_case(operation, size, inputs, work_dir):
+    from instrument import enable_profiling, finish_profiling
+    os.chdir(work_dir)
+    output_name = f"{operation}.avi"
+    width, height = parse_resolution(size)
+
+    # The operations print progress for every run, which would bury the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        enable_profiling(f"{operation} {size}")
+        if operation == "detect_night":
+            from detectNight import detect_night
+            detect_night(inputs[f"night {size}"], output_name)
+        elif operation == "blur_faces":
+            from blurFaces import blur_faces
+            blur_faces(inputs[f"day {size}"], output_name)
+        elif operation == "overlay_video":
+            from overlay import overlay_video
+            overlay_video(inputs[f"day {size}"], output_name, overlay_path=inputs["overlay"],
+                          resolution=(width // 4, height // 4))
+        elif operation == "add_watermark":
+            from watermark import add_watermark
+            add_watermark(inputs[f"day {size}"], output_name, watermark_path=inputs["watermark"])
+        elif operation == "stitching":
+            from stitching import stitching
+            stitching(inputs[f"day {size}"], output_name, stitch_file_path=inputs[f"day {size}"])
+        elif operation == "stitching_resample":
+            from stitching import stitching
+            stitching(inputs[f"day {size}"], output_name, stitch_file_path=inputs["endscreen"])
+        elif operation == "extract_paragraphs":
+            sys.path.append(TASK_B_DIR)
+            from pageSegmentation import extract_paragraphs
+            extract_paragraphs(inputs[f"pages {size}"], "task-B/paragraphs")
+        report = finish_profiling()
+
+    # Leaves the workspace empty for the next case
+    for folder in ("task-A/processed-files-A", "task-B/paragraphs"):
+        for name in os.listdir(folder):
+            os.remove(os.path.join(folder, name))
+    return report
+
+# Runs every operation over the size grid, keeping the fastest of repeats runs of each case
+# Returns the results keyed by "operation WIDTHxHEIGHT"
+def run_benchmarks(operations, sizes, frame_count=30, fps=25, page_sizes=(), pages=4, repeats=1, work_dir=None):
+    with contextlib.ExitStack() as stack:
+        if work_dir is None:
+            work_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix="dip-benchmark-"))
+        work_dir = os.path.abspath(work_dir)
+        inputs = prepare_workspace(work_dir, sizes, frame_count, fps, page_sizes, pages)
+
+        cases = [(operation, f"{width}x{height}") for operation in operations if operation in VIDEO_OPERATIONS
+                 for width, height in sizes]
+        cases += [(operation, f"{width}x{height}") for operation in operations if operation in PAGE_OPERATIONS
+                  for width, height in page_sizes]
+
+        results = {}
+        for operation, size in cases:
+            reports = []
+            for _ in range(repeats):
+                # A new process per run, so the peak memory belongs to this case alone
+                # (peak_rss_mb reads the high-water mark of the process image, which exec resets on Linux)
+                with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as executor:
+                    reports.append(executor.submit(run_case, operation, size, inputs, work_dir).result())
+            report = min(reports, key=lambda report: report["wall_seconds"])
+
+            unit = "pages" if operation in PAGE_OPERATIONS else "frames"
+            results[f"{operation} {size}"] = {
+                "operation": operation,
+                "size": size,
+                "seconds": report["wall_seconds"],
+                "units": unit,
+                "count": report["counters"].get(unit, 0),
+                "throughput": report["rates"].get(f"{unit}_per_second", 0.0),
+                "peak_rss_mb": report["peak_rss_mb"],
+                "stages": {entry["stage"]: entry["seconds"] for entry in report["stages"]},
+            }
+            result = results[f"{operation} {size}"]
+            print(f"{operation + ' ' + size:<32}{result['throughput']:>10.2f} {unit}/s"
+                  f"{result['seconds']:>10.2f} s{result['peak_rss_mb'] or 0:>10.1f} MB")
+    return results
+
+# Compares results against a baseline and prints every case that got slower or used more memory
+# Returns the number of regressions
+def compare_results(results, baseline, tolerance=0.1):
+    regressions = 0
+    print(f"\n{'case':<32}{'baseline':>12}{'current':>12}{'change':>10}  flags")
+    for name, result in results.items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            print(f"{name:<32}{'-':>12}{result['throughput']:>12.2f}{'':>10}  new")
+            continue
+
+        flags = []
+        change = result["throughput"] / previous["throughput"] - 1 if previous["throughput"] else 0.0
+        if change < -tolerance:
+            flags.append("SLOWER")
+        # Small absolute differences in memory are allocator noise
+        if (result["peak_rss_mb"] is not None and previous["peak_rss_mb"] is not None
+                and result["peak_rss_mb"] > previous["peak_rss_mb"] * (1 + tolerance) + 5):
+            flags.append(f"MORE MEMORY ({previous['peak_rss_mb']:.0f} -> {result['peak_rss_mb']:.0f} MB)")
+        regressions += bool(flags)
+        print(f"{name:<32}{previous['throughput']:>12.2f}{result['throughput']:>12.2f}{100 * change:>9.1f}%  "
+              f"{' '.join(flags)}")
+
+    print(f"\n{regressions} regression(s) beyond {100 * tolerance:.0f}% against the baseline from {baseline['created']}.")
+    return regressions
+
+# Command line entry point
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark task-A and task-B on synthetic inputs.")
+    parser.add_argument("--operations", nargs="+", default=list(OPERATIONS), choices=OPERATIONS,
+                        help="operations to run (default: all)")
+    parser.add_argument("--sizes", nargs="+", type=parse_resolution, default=[(640, 360), (1280, 720), (1920, 1080)],
+                        help="video frame sizes, e.g. 640x360 1280x720")
+    parser.add_argument("--frames", type=int, default=30, help="frames per synthetic clip")
+    parser.add_argument("--fps", type=float, default=25, help="frame rate of the synthetic clips")
+    parser.add_argument("--page-sizes", nargs="+", type=parse_resolution, default=[(1240, 1754), (2480, 3508)],
+                        help="document page sizes, e.g. 1240x1754 (A4 at 150 dpi)")
+    parser.add_argument("--pages", type=int, default=4, help="synthetic pages per page size")
+    parser.add_argument("--repeats", type=int, default=1, help="runs per case, the fastest one counts")
+    parser.add_argument("--work-dir", default=None, help="keep the generated inputs here instead of a temporary folder")
+    parser.add_argument("--save", metavar="PATH", default=None, help="save the results as a baseline file")
+    parser.add_argument("--compare", metavar="PATH", default=None, help="compare the results against a baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="allowed relative slowdown or memory growth before a case is flagged")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.operations, args.sizes, args.frames, args.fps, args.page_sizes, args.pages,
+                             args.repeats, args.work_dir)
+
+    if args.save is not None:
+        baseline = {"created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "machine": {"platform": platform.platform(), "processor": platform.processor(),
+                                "cpus": os.cpu_count(), "python": platform.python_version(),
+                                "opencv": cv2.__version__, "numpy": np.__version__},
+                    "settings": {"frames": args.frames, "fps": args.fps, "pages": args.pages, "repeats": args.repeats},
+                    "results": results}
+        with open(args.save, "w") as baseline_file:
+            json.dump(baseline, baseline_file, indent=2)
+        print(f"Baseline saved to {args.save}")
+
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare_results(results, baseline, args.tolerance) > 0:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
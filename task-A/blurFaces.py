@@ -1,41 +1,68 @@
+import time
 import cv2
+import numpy as np
+from instrument import stage
 from main import prep_video
 
+# Haar cascade and detectMultiScale parameters of the face detector (minimum face size in full resolution pixels)
+FACE_CASCADE_PATH = "task-A/face_detector.xml"
+FACE_SCALE_FACTOR = 1.1
+FACE_MIN_NEIGHBORS = 5
+FACE_MIN_SIZE = 30
+
+# Trackers that move the face boxes between detections
+TRACKER_TYPES = ("hold", "flow", "mil")
+
+# Ways to anonymize a face region, all tuned to roughly the strength of a Gaussian blur with sigma 30
+ANONYMIZE_METHODS = ("gaussian", "downsample", "pixelate", "box")
+BLUR_SIGMA = 30
+DOWNSAMPLE_FACTOR = 8
+PIXELATE_BLOCK = 20
+# Three stacked box filters of this width have the same variance as the Gaussian
+BOX_WIDTH = int(round(np.sqrt(12 * BLUR_SIGMA ** 2 / 3 + 1))) | 1
+
 # Function to detect and blur faces in a video
-def blur_faces(video_file_path, output_file_name):
+# detect_every runs the detector on every Nth frame only, on a grayscale image downscaled by downscale,
+# and the boxes are carried over in between by the selected tracker (see make_tracking_blur_filter)
+# method selects the anonymization backend (see ANONYMIZE_METHODS)
+# With index_path the boxes come from that face index if it matches the video and settings, otherwise the
+# detected boxes are saved there for later runs (see faceIndex.py)
+def blur_faces(video_file_path, output_file_name, detect_every=1, downscale=1, tracker_type="hold", keep_alive=0,
+               method="gaussian", index_path=None):
     # Prepare the video and output file
     vid, out, total_frames = prep_video(video_file_path, output_file_name)
-    
+
     if vid is None or out is None:
         print("Error: Video preparation failed.")
         return
-    
-    # Load the Haar cascade for face detection
-    face_cascade = cv2.CascadeClassifier("task-A/face_detector.xml")
-    if face_cascade.empty():
-        print("Error: Failed to load face detection model. Check file path.")
+
+    # Detects on every full resolution frame unless asked otherwise
+    stats = {}
+    face_index = None
+    if index_path is not None:
+        from faceIndex import make_index_blur_filter, open_face_index
+        face_index = open_face_index(video_file_path, index_path, detect_every, downscale, tracker_type, keep_alive)
+        blur_filter = make_index_blur_filter(face_index, method, detect_every, downscale, tracker_type, keep_alive,
+                                             stats)
+    elif detect_every == 1 and downscale == 1:
+        blur_filter = make_blur_filter(method, stats)
+    else:
+        blur_filter = make_tracking_blur_filter(detect_every, downscale, tracker_type, keep_alive, method, stats)
+    if blur_filter is None:
         return
 
     frame_count = 0
     print("Face blurring in progress...\n")
-    
+    start_time = time.perf_counter()
+
     # Read and process each frame
     while True:
         ret, frame = vid.read()
         if not ret:
             break  # Break if no frames are left
 
-        # Convert frame to grayscale for face detection
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-        # Detect faces in the frame
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
-
-        # Blur detected faces
-        for (x, y, w, h) in faces:
-            face_region = frame[y:y+h, x:x+w]
-            blurred_face = cv2.GaussianBlur(face_region, (99, 99), 30)
-            frame[y:y+h, x:x+w] = blurred_face  # Replace original face with blurred one
+        frame = blur_filter(frame)
+        frame_count += 1
 
         # Write the processed frame to the output file
         out.write(frame)
@@ -44,4 +71,244 @@ def blur_faces(video_file_path, output_file_name):
     vid.release()
     out.release()
     cv2.destroyAllWindows()
+    if face_index is not None and face_index["recording"]:
+        from faceIndex import save_face_index
+        save_face_index(face_index, index_path)
+    print_blur_report(stats, frame_count, time.perf_counter() - start_time)
     print("Face blurring complete. Video released.\n")
+
+# Prints how fast detection runs compared with the whole blurring loop
+def print_blur_report(stats, frame_count, elapsed):
+    detections = stats.get("detections", 0)
+    if detections == 0 or elapsed == 0:
+        return
+    detection_time = stats["detection_time"]
+    print(f"Ran {detections} detections on {frame_count} frames: "
+          f"{detections / detection_time:.1f} detections/s, {frame_count / elapsed:.1f} frames/s overall "
+          f"({100 * detection_time / elapsed:.0f}% of the time spent detecting)")
+
+# Loads the Haar cascade used for face detection
+def load_face_cascade():
+    face_cascade = cv2.CascadeClassifier(FACE_CASCADE_PATH)
+    if face_cascade.empty():
+        print("Error: Failed to load face detection model. Check file path.")
+        return None
+    return face_cascade
+
+# Detects faces in a grayscale image, optionally on a downscaled copy with the boxes scaled back up
+def detect_faces(gray, face_cascade, downscale=1):
+    if downscale > 1:
+        small = cv2.resize(gray, None, fx=1 / downscale, fy=1 / downscale, interpolation=cv2.INTER_AREA)
+        min_size = max(1, round(FACE_MIN_SIZE / downscale))
+        faces = face_cascade.detectMultiScale(small, scaleFactor=FACE_SCALE_FACTOR, minNeighbors=FACE_MIN_NEIGHBORS,
+                                              minSize=(min_size, min_size))
+        return [tuple(int(round(value * downscale)) for value in face) for face in faces]
+    faces = face_cascade.detectMultiScale(gray, scaleFactor=FACE_SCALE_FACTOR, minNeighbors=FACE_MIN_NEIGHBORS,
+                                          minSize=(FACE_MIN_SIZE, FACE_MIN_SIZE))
+    return [tuple(face) for face in faces]
+
+# Anonymizes an image region with the given method and returns the result
+def anonymize_region(region, method="gaussian"):
+    height, width = region.shape[:2]
+    if method == "gaussian":
+        return cv2.GaussianBlur(region, (99, 99), BLUR_SIGMA)
+    elif method == "downsample":
+        # Blurring a smaller copy needs a proportionally smaller kernel
+        small = cv2.resize(region, (max(1, width // DOWNSAMPLE_FACTOR), max(1, height // DOWNSAMPLE_FACTOR)),
+                           interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(small, (0, 0), BLUR_SIGMA / DOWNSAMPLE_FACTOR)
+        return cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+    elif method == "pixelate":
+        # Averages blocks of pixels, then blows them back up as a mosaic
+        small = cv2.resize(region, (max(1, width // PIXELATE_BLOCK), max(1, height // PIXELATE_BLOCK)),
+                           interpolation=cv2.INTER_AREA)
+        return cv2.resize(small, (width, height), interpolation=cv2.INTER_NEAREST)
+    elif method == "box":
+        # Box filters cost the same for any width, and three passes approximate a Gaussian
+        blurred = cv2.blur(region, (BOX_WIDTH, BOX_WIDTH))
+        blurred = cv2.blur(blurred, (BOX_WIDTH, BOX_WIDTH))
+        return cv2.blur(blurred, (BOX_WIDTH, BOX_WIDTH))
+    else:
+        raise ValueError(f"Unknown anonymization method {method}. Use one of {', '.join(ANONYMIZE_METHODS)}.")
+
+# Blurs the given face boxes in a frame, clipping them to the frame
+def blur_boxes(frame, boxes, method="gaussian"):
+    frame_height, frame_width = frame.shape[:2]
+    for (x, y, w, h) in boxes:
+        x, y = max(0, x), max(0, y)
+        w, h = min(w, frame_width - x), min(h, frame_height - y)
+        if w <= 0 or h <= 0:
+            continue
+        face_region = frame[y:y+h, x:x+w]
+        blurred_face = anonymize_region(face_region, method)
+        frame[y:y+h, x:x+w] = blurred_face  # Replace original face with blurred one
+    return frame
+
+# Detects and blurs the faces in a single frame
+def blur_frame(frame, face_cascade, method="gaussian"):
+    # Convert frame to grayscale for face detection
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+    # Detect faces in the frame and blur them
+    return blur_boxes(frame, detect_faces(gray, face_cascade), method)
+
+# Checks that the anonymization method exists before any frame is processed
+def check_anonymize_method(method):
+    if method not in ANONYMIZE_METHODS:
+        print(f"Error: Unknown anonymization method {method}. Use one of {', '.join(ANONYMIZE_METHODS)}.")
+        return False
+    return True
+
+# Builds a per-frame face blurring filter for the pipeline
+# record, if given, is a list that gets the boxes blurred in every frame appended to it (see faceIndex.py)
+def make_blur_filter(method="gaussian", stats=None, record=None):
+    if not check_anonymize_method(method):
+        return None
+    face_cascade = load_face_cascade()
+    if face_cascade is None:
+        return None
+    if stats is None:
+        stats = {}
+    stats.update(detections=0, detection_time=0.0)
+
+    def blur_filter(frame):
+        start_time = time.perf_counter()
+        with stage("face_detect"):
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            faces = detect_faces(gray, face_cascade)
+        stats["detections"] += 1
+        stats["detection_time"] += time.perf_counter() - start_time
+        if record is not None:
+            record.append([[int(value) for value in face] for face in faces])
+        with stage("anonymize"):
+            return blur_boxes(frame, faces, method)
+    return blur_filter
+
+# Overlap between two (x, y, w, h) boxes as intersection over union
+def box_iou(box_a, box_b):
+    ax, ay, aw, ah = box_a
+    bx, by, bw, bh = box_b
+    overlap_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    overlap_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    overlap = overlap_w * overlap_h
+    union = aw * ah + bw * bh - overlap
+    return overlap / union if union > 0 else 0.0
+
+# Moves a box by the median optical flow of a few corners found inside it
+def flow_box(prev_gray, gray, box):
+    x, y, w, h = box
+    frame_height, frame_width = gray.shape
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(frame_width, x + w), min(frame_height, y + h)
+    if x1 - x0 < 2 or y1 - y0 < 2:
+        return box
+
+    corners = cv2.goodFeaturesToTrack(prev_gray[y0:y1, x0:x1], maxCorners=20, qualityLevel=0.01, minDistance=3)
+    if corners is None:
+        return box
+    corners = corners + np.array([x0, y0], dtype=np.float32)
+    moved, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, corners, None)
+    tracked = status.ravel() == 1
+    if not tracked.any():
+        return box
+    dx, dy = np.median((moved - corners)[tracked].reshape(-1, 2), axis=0)
+    return (int(round(x + dx)), int(round(y + dy)), w, h)
+
+# Builds a face blurring filter that only detects on every Nth frame and tracks the boxes in between
+# tracker_type is "hold" (keep the last boxes), "flow" (Lucas-Kanade optical flow) or "mil" (cv2.TrackerMIL)
+# A face that the detector misses stays blurred for keep_alive more frames, which avoids flicker
+# record works as in make_blur_filter
+# start_frame is the frame number of the first frame it gets, so a run that starts part way into the video detects
+# on the same frames as a run from the start. Tracks and their keep_alive count start empty there, so the boxes
+# until the first detection frame (and faces kept alive across that point) can differ from a run from the start
+def make_tracking_blur_filter(detect_every=5, downscale=2, tracker_type="flow", keep_alive=10, method="gaussian",
+                              stats=None, record=None, start_frame=0):
+    if tracker_type not in TRACKER_TYPES:
+        print(f"Error: Unknown tracker type {tracker_type}. Use one of {', '.join(TRACKER_TYPES)}.")
+        return None
+    if not check_anonymize_method(method):
+        return None
+    face_cascade = load_face_cascade()
+    if face_cascade is None:
+        return None
+    if stats is None:
+        stats = {}
+    stats.update(detections=0, detection_time=0.0)
+
+    # Each track is [box, frames since it was last detected, MIL tracker or None]
+    tracks = []
+    state = {"frame_index": start_frame, "prev_gray": None}
+
+    # Moves the given tracks from the previous frame to this one, returning the grayscale frame if it was needed
+    def advance_tracks(frame, moving):
+        gray = None
+        with stage("face_track"):
+            if tracker_type == "flow":
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                for track in moving:
+                    track[0] = flow_box(state["prev_gray"], gray, track[0])
+            elif tracker_type == "mil":
+                for track in moving:
+                    found, box = track[2].update(frame)
+                    if found:
+                        track[0] = tuple(box)
+        return gray
+
+    def tracking_blur_filter(frame):
+        gray = None
+        if state["frame_index"] % detect_every == 0:
+            # Tracks that can outlive this detection are moved first, so they neither freeze on this frame nor
+            # (with MIL) miss a frame; the others are replaced by the new detections anyway
+            for track in tracks:
+                track[1] += detect_every
+            moving = [track for track in tracks if track[1] <= keep_alive]
+            if moving:
+                gray = advance_tracks(frame, moving)
+
+            start_time = time.perf_counter()
+            with stage("face_detect"):
+                if gray is None:
+                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                faces = detect_faces(gray, face_cascade, downscale)
+            stats["detections"] += 1
+            stats["detection_time"] += time.perf_counter() - start_time
+
+            # Keeps recently seen faces that the detector missed this time
+            kept = [track for track in moving if all(box_iou(track[0], face) < 0.3 for face in faces)]
+            tracks[:] = kept + [[face, 0, None] for face in faces]
+
+            if tracker_type == "mil":
+                for track in tracks:
+                    if track[2] is None:
+                        track[2] = cv2.TrackerMIL_create()
+                        track[2].init(frame, track[0])
+        elif tracks:
+            gray = advance_tracks(frame, tracks)
+
+        state["prev_gray"] = gray
+        state["frame_index"] += 1
+        boxes = [track[0] for track in tracks]
+        if record is not None:
+            record.append([[int(value) for value in box] for box in boxes])
+        with stage("anonymize"):
+            return blur_boxes(frame, boxes, method)
+    return tracking_blur_filter
+
+# Micro-benchmark of the anonymization methods: prints ms per face for square face regions of each size
+def benchmark_anonymizers(sizes=(32, 64, 128, 256, 512), repeats=20):
+    rng = np.random.default_rng(0)
+    print("Size      " + "".join(f"{method:>12}" for method in ANONYMIZE_METHODS))
+    for size in sizes:
+        region = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+        timings = []
+        for method in ANONYMIZE_METHODS:
+            anonymize_region(region, method)  # Warm-up
+            start_time = time.perf_counter()
+            for _ in range(repeats):
+                anonymize_region(region, method)
+            timings.append(1000 * (time.perf_counter() - start_time) / repeats)
+        print(f"{size}x{size}".ljust(10) + "".join(f"{timing:>10.2f}ms" for timing in timings))
+
+# Runs the anonymization micro-benchmark, e.g. python task-A/blurFaces.py
+if __name__ == "__main__":
+    benchmark_anonymizers()
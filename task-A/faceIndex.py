@@ -0,0 +1,242 @@
+import argparse
+import hashlib
+import json
+import os
+import numpy as np
+from instrument import stage
+
+# A face index is a sidecar file holding the face boxes blurred in every frame of one video, so a later run
+# (say with another anonymization method) can skip face detection altogether. It is keyed by a hash of the
+# video and of everything that decides the boxes: the cascade and its detectMultiScale parameters, the
+# detection downscale and the tracking settings. Boxes are [x, y, w, h]; detected boxes are kept per frame and
+# boxes added by hand are kept apart, so they survive a re-detection of the same video. Manage an index with e.g.
+# python task-A/faceIndex.py info office.faces.npz
+# python task-A/faceIndex.py add office.faces.npz --frames 120-180 --box 400,80,120,120
+# python task-A/faceIndex.py remove office.faces.npz --frames 0-50 --box 0,0,640,360
+# python task-A/faceIndex.py merge merged.faces.npz office.faces.npz office-manual.faces.npz
+
+# Chunk size used to hash the video file
+HASH_CHUNK_SIZE = 1 << 20
+
+# Default index file of a video, next to it
+def default_index_path(video_path):
+    return os.path.splitext(video_path)[0] + ".faces.npz"
+
+# Content hash of a file, read in chunks
+def file_hash(file_path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as hashed_file:
+        for chunk in iter(lambda: hashed_file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Everything besides the video that decides which boxes get blurred
+def detection_params(detect_every=1, downscale=1, tracker_type="hold", keep_alive=0):
+    from blurFaces import FACE_CASCADE_PATH, FACE_MIN_NEIGHBORS, FACE_MIN_SIZE, FACE_SCALE_FACTOR
+    return {"cascade": file_hash(FACE_CASCADE_PATH), "scale_factor": FACE_SCALE_FACTOR,
+            "min_neighbors": FACE_MIN_NEIGHBORS, "min_size": FACE_MIN_SIZE, "downscale": downscale,
+            "detect_every": detect_every, "tracker": tracker_type, "keep_alive": keep_alive}
+
+# Key of the boxes of one video detected with the given parameters
+def index_key(video_hash, params):
+    return video_hash + ":" + json.dumps(params, sort_keys=True)
+
+# An empty index: "detected" is a list with the boxes of every frame, "manual" maps frame numbers to boxes
+def new_face_index(video_hash, params):
+    return {"key": index_key(video_hash, params), "video_hash": video_hash, "params": params,
+            "detected": [], "manual": {}}
+
+# Loads an index saved by save_face_index, or returns None if it cannot be read
+def load_face_index(index_path):
+    try:
+        with np.load(index_path) as saved:
+            params = json.loads(str(saved["params"]))
+            index = new_face_index(str(saved["video_hash"]), params)
+            frames, boxes, manual = saved["frame"], saved["box"].tolist(), saved["manual"]
+            frame_count = int(saved["frame_count"])
+    except (OSError, KeyError, ValueError) as error:
+        print(f"Error: Cannot read face index {index_path} ({error})")
+        return None
+
+    index["detected"] = [[] for _ in range(frame_count)]
+    for frame_number, box, is_manual in zip(frames.tolist(), boxes, manual.tolist()):
+        if is_manual:
+            index["manual"].setdefault(frame_number, []).append(box)
+        else:
+            index["detected"][frame_number].append(box)
+    return index
+
+# Saves an index as flat arrays: the frame number, box and manual flag of every box, sorted by frame
+def save_face_index(index, index_path):
+    rows = [(frame_number, box, False) for frame_number, boxes in enumerate(index["detected"]) for box in boxes]
+    rows += [(frame_number, box, True) for frame_number, boxes in index["manual"].items() for box in boxes]
+    rows.sort(key=lambda row: row[0])
+    frame_count = max([len(index["detected"])] + [frame_number + 1 for frame_number in index["manual"]])
+    np.savez_compressed(index_path, video_hash=np.array(index["video_hash"]),
+                        params=np.array(json.dumps(index["params"], sort_keys=True)),
+                        frame_count=np.array(frame_count),
+                        frame=np.array([row[0] for row in rows], dtype=np.int32),
+                        box=np.array([row[1] for row in rows], dtype=np.int32).reshape(-1, 4),
+                        manual=np.array([row[2] for row in rows], dtype=bool))
+    print(f"Face index saved to {index_path} ({len(rows)} boxes over {frame_count} frames)")
+
+# Opens the index of a video for a blurring run
+# Returns the saved index if it matches the video and parameters, otherwise a new index for the run to fill,
+# keeping the manual boxes of a saved index of the same video. index["recording"] tells which one it is
+def open_face_index(video_path, index_path, detect_every=1, downscale=1, tracker_type="hold", keep_alive=0):
+    with stage("face_index"):
+        video_hash = file_hash(video_path)
+        params = detection_params(detect_every, downscale, tracker_type, keep_alive)
+        saved = load_face_index(index_path) if os.path.exists(index_path) else None
+
+    if saved is not None and saved["key"] == index_key(video_hash, params):
+        print(f"Using the face boxes of {index_path}, skipping detection.")
+        saved["recording"] = False
+        return saved
+
+    index = new_face_index(video_hash, params)
+    index["recording"] = True
+    if saved is not None and saved["video_hash"] == video_hash:
+        print(f"Face index {index_path} was detected with other settings, detecting again.")
+        index["manual"] = saved["manual"]
+    return index
+
+# Builds the face blurring filter of a run with an index: it blurs the saved boxes of every frame if the index was
+# loaded, or detects faces like make_blur_filter/make_tracking_blur_filter and records the boxes into the index
+# start_frame is the frame number of the first frame it gets, when a run starts part way into the video
+def make_index_blur_filter(index, method="gaussian", detect_every=1, downscale=1, tracker_type="hold", keep_alive=0,
+                           stats=None, start_frame=0):
+    from blurFaces import blur_boxes, check_anonymize_method, make_blur_filter, make_tracking_blur_filter
+    if index["recording"]:
+        if detect_every == 1 and downscale == 1:
+            detect_filter = make_blur_filter(method, stats, index["detected"])
+        else:
+            detect_filter = make_tracking_blur_filter(detect_every, downscale, tracker_type, keep_alive, method, stats,
+                                                      index["detected"], start_frame)
+        if detect_filter is None:
+            return None
+    elif not check_anonymize_method(method):
+        return None
+
+    state = {"frame_index": start_frame}
+
+    def index_blur_filter(frame):
+        frame_index = state["frame_index"]
+        state["frame_index"] += 1
+        if index["recording"]:
+            frame = detect_filter(frame)
+        elif frame_index < len(index["detected"]):
+            with stage("anonymize"):
+                frame = blur_boxes(frame, index["detected"][frame_index], method)
+        # Boxes added by hand are blurred after the detected ones
+        if frame_index in index["manual"]:
+            with stage("anonymize"):
+                frame = blur_boxes(frame, index["manual"][frame_index], method)
+        return frame
+    return index_blur_filter
+
+# Parses "START-END" (inclusive) or a single frame number into a range of frames
+def parse_frames(frames):
+    start, _, end = frames.partition("-")
+    return range(int(start), int(end or start) + 1)
+
+# Parses "X,Y,W,H" into a box
+def parse_box(box):
+    values = [int(value) for value in box.split(",")]
+    if len(values) != 4:
+        raise argparse.ArgumentTypeError("a box is X,Y,W,H")
+    return values
+
+# Adds a box by hand to a range of frames
+def add_box(index, frames, box):
+    for frame_number in frames:
+        index["manual"].setdefault(frame_number, []).append(list(box))
+
+# Removes the detected and manual boxes centred inside a region in a range of frames
+# Returns the number of removed boxes
+def remove_boxes(index, frames, region):
+    x, y, w, h = region
+
+    # Tells if a box is centred inside the region
+    def inside(box):
+        return x <= box[0] + box[2] / 2 < x + w and y <= box[1] + box[3] / 2 < y + h
+
+    removed = 0
+    for frame_number in frames:
+        for boxes in (index["detected"][frame_number] if frame_number < len(index["detected"]) else [],
+                      index["manual"].get(frame_number, [])):
+            kept = [box for box in boxes if not inside(box)]
+            removed += len(boxes) - len(kept)
+            boxes[:] = kept
+    index["manual"] = {frame_number: boxes for frame_number, boxes in index["manual"].items() if boxes}
+    return removed
+
+# Merges indexes of the same video into the first one, adding every box that it does not have yet
+# Returns None if the indexes belong to different videos
+def merge_face_indexes(indexes):
+    merged = indexes[0]
+    for index in indexes[1:]:
+        if index["video_hash"] != merged["video_hash"]:
+            print("Error: Face indexes of different videos cannot be merged.")
+            return None
+        if index["key"] != merged["key"]:
+            print("Warning: Merging face indexes detected with different settings, keeping the first settings.")
+        merged["detected"] += [[] for _ in range(len(index["detected"]) - len(merged["detected"]))]
+        for frame_number, boxes in enumerate(index["detected"]):
+            merged["detected"][frame_number] += [box for box in boxes if box not in merged["detected"][frame_number]]
+        for frame_number, boxes in index["manual"].items():
+            merged_boxes = merged["manual"].setdefault(frame_number, [])
+            merged_boxes += [box for box in boxes if box not in merged_boxes]
+    return merged
+
+# Prints what an index holds
+def print_index_info(index):
+    detected = sum(len(boxes) for boxes in index["detected"])
+    manual = sum(len(boxes) for boxes in index["manual"].values())
+    print(f"Video hash: {index['video_hash']}")
+    print(f"Settings: {json.dumps(index['params'], sort_keys=True)}")
+    print(f"{len(index['detected'])} frames, {detected} detected boxes in "
+          f"{sum(1 for boxes in index['detected'] if boxes)} frames, {manual} manual boxes in {len(index['manual'])} frames")
+
+# Command line entry point for inspecting and editing indexes (see the top of this file)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect, edit and merge face index sidecar files.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    info_parser = commands.add_parser("info", help="print what an index holds")
+    info_parser.add_argument("index")
+    for command, description in (("add", "add a box by hand to a range of frames"),
+                                 ("remove", "remove the boxes centred inside a box in a range of frames")):
+        edit_parser = commands.add_parser(command, help=description)
+        edit_parser.add_argument("index")
+        edit_parser.add_argument("--frames", type=parse_frames, required=True, help="frame or frames, e.g. 120-180")
+        edit_parser.add_argument("--box", type=parse_box, required=True, help="box as X,Y,W,H")
+        edit_parser.add_argument("--output", default=None, help="save the edited index here (default: in place)")
+    merge_parser = commands.add_parser("merge", help="merge indexes of the same video")
+    merge_parser.add_argument("output", help="merged index to write")
+    merge_parser.add_argument("indexes", nargs="+", help="indexes to merge, settings taken from the first")
+    args = parser.parse_args(argv)
+
+    if args.command == "merge":
+        indexes = [load_face_index(index_path) for index_path in args.indexes]
+        if any(index is None for index in indexes):
+            return
+        merged = merge_face_indexes(indexes)
+        if merged is not None:
+            save_face_index(merged, args.output)
+        return
+
+    index = load_face_index(args.index)
+    if index is None:
+        return
+    if args.command == "info":
+        print_index_info(index)
+        return
+    if args.command == "add":
+        add_box(index, args.frames, args.box)
+        print(f"Added the box to {len(args.frames)} frames.")
+    else:
+        print(f"Removed {remove_boxes(index, args.frames, args.box)} boxes.")
+    save_face_index(index, args.output or args.index)
+
+if __name__ == "__main__":
+    main()
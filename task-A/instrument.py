@@ -0,0 +1,169 @@
+import contextlib
+import cProfile
+import csv
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Per-stage timers, counters and peak memory for one run. Profiling is off by default,
+# in which case stage() hands back a shared no-op context and costs almost nothing
+_run = None
+_NO_STAGE = contextlib.nullcontext()
+
+# Starts collecting timings for a run, optionally with cProfile running as well
+def enable_profiling(name, cprofile_path=None):
+    global _run
+    _run = {"name": name, "start": time.perf_counter(), "stages": {}, "counters": {},
+            "cprofile_path": cprofile_path, "cprofile": None}
+    if cprofile_path is not None:
+        _run["cprofile"] = cProfile.Profile()
+        _run["cprofile"].enable()
+
+def profiling_enabled():
+    return _run is not None
+
+# Times the enclosed block under the given stage name, e.g. with stage("decode"): ...
+def stage(name):
+    if _run is None:
+        return _NO_STAGE
+    return _timed_stage(name)
+
+@contextlib.contextmanager
+def _timed_stage(name):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing = _run["stages"].setdefault(name, [0, 0.0])
+        timing[0] += 1
+        timing[1] += time.perf_counter() - start_time
+
+# Adds to a throughput counter such as "frames" or "pages"
+def count(name, amount=1):
+    if _run is not None:
+        _run["counters"][name] = _run["counters"].get(name, 0) + amount
+
+# Stage totals of this process as {name: [calls, seconds]}, e.g. to send from a worker to its parent
+def stage_times():
+    return {} if _run is None else {name: list(timing) for name, timing in _run["stages"].items()}
+
+# Adds stage totals measured elsewhere (such as in a worker process) to this run
+def add_stage_times(stages):
+    if _run is None:
+        return
+    for name, (calls, seconds) in stages.items():
+        timing = _run["stages"].setdefault(name, [0, 0.0])
+        timing[0] += calls
+        timing[1] += seconds
+
+# Peak resident memory of this process in MB, or None where it cannot be measured
+# On Linux VmHWM is read first: ru_maxrss survives exec, so a spawned child would report its parent's peak
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+# Stops profiling, prints the stage table and writes the report as JSON or CSV (by extension)
+# Returns the report as a dictionary
+def finish_profiling(report_path=None):
+    global _run
+    if _run is None:
+        return None
+    run, _run = _run, None
+
+    if run["cprofile"] is not None:
+        run["cprofile"].disable()
+        run["cprofile"].dump_stats(run["cprofile_path"])
+        print(f"cProfile stats saved to {run['cprofile_path']}")
+
+    wall_seconds = time.perf_counter() - run["start"]
+    report = {
+        "name": run["name"],
+        "wall_seconds": wall_seconds,
+        "peak_rss_mb": peak_rss_mb(),
+        "counters": run["counters"],
+        "rates": {f"{name}_per_second": value / wall_seconds for name, value in run["counters"].items()},
+        "stages": [{"stage": name, "calls": calls, "seconds": seconds, "ms_per_call": 1000 * seconds / calls,
+                    "percent_of_wall": 100 * seconds / wall_seconds}
+                   for name, (calls, seconds) in sorted(run["stages"].items(), key=lambda item: -item[1][1])],
+    }
+    print_report(report)
+
+    if report_path is not None:
+        if report_path.lower().endswith(".csv"):
+            write_csv_report(report, report_path)
+        else:
+            with open(report_path, "w") as report_file:
+                json.dump(report, report_file, indent=2)
+        print(f"Run report saved to {report_path}")
+    return report
+
+# Prints the stage timings, throughput and peak memory of a report
+def print_report(report):
+    print(f"\n----- Profile of {report['name']}: {report['wall_seconds']:.2f} s -----")
+    for entry in report["stages"]:
+        print(f"{entry['stage']:<24}{entry['calls']:>8} calls{entry['seconds']:>10.3f} s"
+              f"{entry['ms_per_call']:>10.2f} ms/call{entry['percent_of_wall']:>7.1f}%")
+    for name, value in report["rates"].items():
+        print(f"{name:<24}{value:>10.2f}")
+    if report["peak_rss_mb"] is not None:
+        print(f"{'peak_rss_mb':<24}{report['peak_rss_mb']:>10.1f}")
+
+# Writes a report as CSV rows of kind, name, calls, seconds, ms per call and value
+def write_csv_report(report, report_path):
+    with open(report_path, "w", newline="") as report_file:
+        writer = csv.writer(report_file)
+        writer.writerow(["kind", "name", "calls", "seconds", "ms_per_call", "value"])
+        writer.writerow(["wall", report["name"], "", report["wall_seconds"], "", ""])
+        for entry in report["stages"]:
+            writer.writerow(["stage", entry["stage"], entry["calls"], entry["seconds"], entry["ms_per_call"], ""])
+        for name, value in report["counters"].items():
+            writer.writerow(["counter", name, "", "", "", value])
+        for name, value in report["rates"].items():
+            writer.writerow(["rate", name, "", "", "", value])
+        writer.writerow(["memory", "peak_rss_mb", "", "", "", report["peak_rss_mb"]])
+
+# Adds the profiling options to a command line parser
+def add_profile_arguments(parser):
+    parser.add_argument("--profile", metavar="REPORT", default=None,
+                        help="time every stage and save a run report (.json or .csv)")
+    parser.add_argument("--cprofile", metavar="PATH", default=None, help="also save cProfile stats to PATH")
+
+# Wraps a cv2.VideoCapture so every read is timed as the "decode" stage
+class ProfiledCapture:
+    def __init__(self, vid):
+        self.vid = vid
+
+    def read(self, *args):
+        with stage("decode"):
+            return self.vid.read(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.vid, name)
+
+# Wraps a cv2.VideoWriter so every write is timed as the "encode" stage and counted as an output frame
+class ProfiledWriter:
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, frame):
+        with stage("encode"):
+            self.out.write(frame)
+        count("frames")
+
+    def __getattr__(self, name):
+        return getattr(self.out, name)
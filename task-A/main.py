@@ -1,7 +1,41 @@
+import os
 import cv2
 
+# Output presets for prep_video. Sizes and encode times are for 40 frames of 1280x720 footage:
+#
+#   preset   fourcc  container  size      encode   notes
+#   mjpg     MJPG    avi        2.4 MB    0.28 s   default; every frame is a JPEG, stitching can stream-copy it
+#   xvid     XVID    avi        0.46 MB   0.33 s   MPEG-4 Part 2 in AVI, about 5x smaller than MJPG
+#   mp4v     mp4v    mp4        0.46 MB   0.22 s   MPEG-4 Part 2 in MP4, about 5x smaller than MJPG
+#   h264     avc1    mp4        -         -        smallest, needs an OpenCV build with an H.264 encoder
+#
+# quality (0-100) switches MJPG to OpenCV's own MJPEG writer, which honours it
+# (95: 5.0 MB, 60: 3.9 MB, 30: 3.1 MB for the clip above). cv2.VideoWriter has no bitrate setting,
+# so the codec is the main size lever. fps=None copies the frame rate of the input video.
+OUTPUT_PRESETS = {
+    "mjpg": {"fourcc": "MJPG", "container": "avi"},
+    "xvid": {"fourcc": "XVID", "container": "avi"},
+    "mp4v": {"fourcc": "mp4v", "container": "mp4"},
+    "h264": {"fourcc": "avc1", "container": "mp4"},
+}
+
+# Builds an output spec from a preset, with any of its settings overridden
+def make_output_spec(preset="mjpg", fourcc=None, container=None, quality=None, fps=None):
+    if preset not in OUTPUT_PRESETS:
+        print(f"Error: Unknown output preset {preset}. Use one of {', '.join(OUTPUT_PRESETS)}.")
+        return None
+    output_spec = dict(OUTPUT_PRESETS[preset], quality=quality, fps=fps)
+    if fourcc is not None:
+        output_spec["fourcc"] = fourcc
+    if container is not None:
+        output_spec["container"] = container
+    return output_spec
+
 # Function to import the video file and set output video file
-def prep_video(file_path, output_file_name):
+# With threaded=True, decoding and encoding run on background threads with queues of queue_size frames
+# output_spec (see make_output_spec) sets the codec, container, quality and frame rate, MJPG AVI by default
+# start_frame seeks the video to that frame before the first read
+def prep_video(file_path, output_file_name, threaded=False, queue_size=32, output_spec=None, start_frame=0):
     vid = cv2.VideoCapture(file_path)
     
     # Checks if the video capture object was successfully opened
@@ -14,6 +48,62 @@ def prep_video(file_path, output_file_name):
     frame_height = int(vid.get(cv2.CAP_PROP_FRAME_HEIGHT))
     print(f"Frame width: {frame_width}, Frame height: {frame_height}")
 
+    if output_spec is None:
+        output_spec = make_output_spec()
+
+    # Uses the frame rate of the input video unless one is given
+    fps = output_spec["fps"]
+    if fps is None:
+        fps = vid.get(cv2.CAP_PROP_FPS)
+        if fps <= 0:
+            fps = 30.0
+    print(f"Output: {output_spec['fourcc']} in {output_spec['container']} at {fps:.2f} FPS")
+
+    # Reserves the output file with the extension of the container
+    base_name = output_file_name.rsplit('.', 1)[0]
+    full_output_path = get_output_path(f"{base_name}.{output_spec['container']}")
+
+    # Sets the output video file
+    fourcc = cv2.VideoWriter_fourcc(*output_spec["fourcc"])
+    if output_spec["quality"] is not None and output_spec["fourcc"] == "MJPG":
+        # Only OpenCV's own MJPEG writer supports a quality setting
+        out = cv2.VideoWriter(full_output_path, cv2.CAP_OPENCV_MJPEG, fourcc, fps, (frame_width, frame_height))
+        out.set(cv2.VIDEOWRITER_PROP_QUALITY, output_spec["quality"])
+    else:
+        out = cv2.VideoWriter(full_output_path, fourcc, fps, (frame_width, frame_height))
+
+    # Checks if the codec is available in this OpenCV build
+    if not out.isOpened():
+        print(f"Error: Cannot create output video with codec {output_spec['fourcc']}")
+        vid.release()
+        os.remove(full_output_path)
+        return None, None, 0
+    
+    # Gets the total number of frames
+    total_no_frames = int(vid.get(cv2.CAP_PROP_FRAME_COUNT))
+    print(f"Total number of frames: {total_no_frames}")
+
+    # Seeks instead of decoding the frames before the start
+    if start_frame > 0:
+        vid.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        print(f"Starting at frame {start_frame}")
+
+    # Times every decode and encode when profiling is on (see instrument.py)
+    from instrument import ProfiledCapture, ProfiledWriter, profiling_enabled
+    if profiling_enabled():
+        vid = ProfiledCapture(vid)
+        out = ProfiledWriter(out)
+
+    # Overlaps decoding, processing and encoding
+    if threaded:
+        from threadedIO import ThreadedCapture, ThreadedWriter
+        vid = ThreadedCapture(vid, queue_size)
+        out = ThreadedWriter(out, queue_size)
+
+    return vid, out, total_no_frames
+
+# Creates the output file in the processed files folder, adding a _N suffix if the name is taken
+def get_output_path(output_file_name):
     # Sets a constant output path for processed videos
     output_path = "task-A/processed-files-A/"
 
@@ -21,29 +111,38 @@ def prep_video(file_path, output_file_name):
     full_output_path = output_path + output_file_name
 
     # Checks if the file already exists and modifies the name if necessary
-    base_name, ext = full_output_path.rsplit('.', 1)
-    counter = 1
+    base_name, ext = output_file_name.rsplit('.', 1)
+    # The name can include a subfolder of the output path, whose files are the ones to compare with
+    output_dir = os.path.dirname(full_output_path)
+    file_base = os.path.basename(base_name)
     while True:
         try:
             with open(full_output_path, 'x'):
-                break
+                return full_output_path
         except FileExistsError:
             print("File name already exists. Modifying...")
-            full_output_path = f"{base_name}_{counter}.{ext}"
-            print(f"New file name: {base_name}_{counter}.{ext}")
-            counter += 1
 
-    # Sets the output video file
-    out = cv2.VideoWriter(full_output_path,
-                          cv2.VideoWriter_fourcc(*"MJPG"), 
-                          30.0, 
-                          (frame_width, frame_height))
-    
-    # Gets the total number of frames
-    total_no_frames = int(vid.get(cv2.CAP_PROP_FRAME_COUNT))
-    print(f"Total number of frames: {total_no_frames}")
-    
-    return vid, out, total_no_frames
+        # Picks the next free suffix from one directory listing instead of probing names one by one
+        counter = 0
+        for existing_name in os.listdir(output_dir):
+            existing_base, _, existing_ext = existing_name.rpartition('.')
+            suffix = existing_base[len(file_base) + 1:]
+            if existing_ext == ext and existing_base.startswith(file_base + "_") and suffix.isdigit():
+                counter = max(counter, int(suffix))
+        full_output_path = f"{output_path}{base_name}_{counter + 1}.{ext}"
+        print(f"New file name: {full_output_path}")
+
+# Adds the output spec options to a command line parser
+def add_output_arguments(parser):
+    parser.add_argument("--preset", default="mjpg", choices=OUTPUT_PRESETS, help="output codec and container")
+    parser.add_argument("--fourcc", default=None, help="override the codec fourcc of the preset")
+    parser.add_argument("--container", default=None, help="override the container (file extension) of the preset")
+    parser.add_argument("--quality", type=int, default=None, help="MJPG quality from 0 to 100")
+    parser.add_argument("--fps", type=float, default=None, help="output frame rate (default: same as the input)")
+
+# Builds the output spec from the parsed command line options
+def output_spec_from_args(args):
+    return make_output_spec(args.preset, args.fourcc, args.container, args.quality, args.fps)
 
 # Gets user input for video path and output file name
 def get_user_input():
@@ -56,7 +155,16 @@ def get_user_input():
 # MAIN FUNCTION
 # ===========================================================================================================
 
-def main():
+# With --profile, the stage timings of the whole session are reported on exit
+def main(argv=None):
+    import argparse
+    from instrument import add_profile_arguments, enable_profiling, finish_profiling
+    parser = argparse.ArgumentParser(description="Interactive task-A video processing menu.")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.profile is not None or args.cprofile is not None:
+        enable_profiling("menu session", args.cprofile)
+
     while True:
         print("\n============= SIMPLE VIDEO PROCESSING TOOL =============")
         print("Select a task to perform:")
@@ -65,10 +173,12 @@ def main():
         print("3. Resize and overlay the talking video on the top left")
         print("4. Add watermark to the video")
         print("5. Append ending screen to the video")
-        print("6. Exit")
-        choice = input("Enter your choice (1-6): ")
+        print("6. Run several tasks in one pass")
+        print("7. Exit")
+        choice = input("Enter your choice (1-7): ")
 
-        if choice == '6':
+        if choice == '7':
+            finish_profiling(args.profile)
             print("Exiting... Goodbye!\n")
             break
         # Detects night in the video and brightens the video if it is night
@@ -96,6 +206,13 @@ def main():
             file_path, output_file_name = get_user_input()
             from stitching import stitching
             stitching(file_path, output_file_name)
+        # Chains several tasks over a single decode and encode of the video
+        elif choice == '6':
+            file_path, output_file_name = get_user_input()
+            from pipeline import get_pipeline_input, run_pipeline
+            filters, append_path = get_pipeline_input(file_path)
+            if filters is not None:
+                run_pipeline(file_path, output_file_name, filters, append_path)
         else:
             print("Invalid choice. Please select a valid option.")
 
@@ -1,19 +1,29 @@
+import tempfile
 import cv2
+import numpy as np
+from instrument import stage
 from main import prep_video
 
-def overlay_video(video_file_path, output_file_name):
+# overlay_path and resolution are asked for when not given
+def overlay_video(video_file_path, output_file_name, max_memory_mb=512, cache_dir=None, overlay_path=None,
+                  resolution=None):
     # Prepares the video file for processing
     vid, out, total_frames = prep_video(video_file_path, output_file_name)
 
     # Read overlay video
-    overlay_path = getOverlayPath()
-    overlay = cv2.VideoCapture(overlay_path)
-    if not overlay.isOpened():
-        print(f"Error: Cannot open video file {overlay_path}")
-        return
+    if overlay_path is None:
+        overlay_path = getOverlayPath()
 
     # Gets the new width and height needed for the overlay
-    new_width, new_height = getResolution()
+    if resolution is None:
+        resolution = getResolution()
+    new_width, new_height = resolution
+
+    # Decodes and resizes the overlay once, every loop afterwards reads from the cache
+    with stage("overlay_cache"):
+        overlay_frames = load_overlay_frames(overlay_path, new_width, new_height, max_memory_mb, cache_dir)
+    if overlay_frames is None:
+        return
 
     # Loop through video frames using a for loop
     for frame_count in range(int(total_frames)):
@@ -23,42 +33,94 @@ def overlay_video(video_file_path, output_file_name):
             print(f"Stopped: Unable to read frame {frame_count} from the main video.")
             break
 
-        # Read frames from the overlay video
-        success_overlay, overlay_frame = overlay.read()
-        if not success_overlay:
-            # If overlay video ends, restart from the first frame
-            overlay.set(cv2.CAP_PROP_POS_FRAMES, 0)
-            success_overlay, overlay_frame = overlay.read()
-            if not success_overlay:
-                print(f"Error: Unable to read frame {frame_count} from the overlay video after restart.")
-                break
-
-        # Resize the overlay frame to the specified resolution
-        resized_overlay = cv2.resize(overlay_frame, (new_width, new_height))
-
-        # Determine the position for the overlay (top-left corner)
-        main_height, main_width, _ = main_frame.shape
-        x_offset = 0  # Horizontal offset (top-left)
-        y_offset = 0  # Vertical offset (top-left)
-
-        # Ensure the overlay fits within the main frame
-        if y_offset + new_height > main_height or x_offset + new_width > main_width:
-            print("Error: Overlay size exceeds main frame dimensions.")
+        # Restarts the overlay from the first frame whenever it ends
+        with stage("overlay"):
+            main_frame = overlay_frame_on(main_frame, overlay_frames[frame_count % len(overlay_frames)])
+        if main_frame is None:
             break
 
-        # Place the overlay directly on the main frame
-        main_frame[y_offset:y_offset + new_height, x_offset:x_offset + new_width] = resized_overlay
-
         # Write the combined frame to the output video
         out.write(main_frame)
 
     # Release resources
     vid.release()
-    overlay.release()
     out.release()
     print(f"Overlay video created successfully! Processed {frame_count + 1} frames.")
 
-def getResolution(): 
+# Decodes the whole overlay video once and resizes every frame into a preallocated buffer
+# The buffer stays in memory up to max_memory_mb and is otherwise a memory-mapped temporary file in cache_dir
+def load_overlay_frames(overlay_path, new_width, new_height, max_memory_mb=512, cache_dir=None):
+    overlay = cv2.VideoCapture(overlay_path)
+    if not overlay.isOpened():
+        print(f"Error: Cannot open video file {overlay_path}")
+        return None
+
+    overlay_frame_count = int(overlay.get(cv2.CAP_PROP_FRAME_COUNT))
+    if overlay_frame_count <= 0:
+        print(f"Error: Cannot get the number of frames of {overlay_path}")
+        overlay.release()
+        return None
+
+    # Allocates the cache for every resized overlay frame
+    shape = (overlay_frame_count, new_height, new_width, 3)
+    cache_mb = np.prod(shape) / (1024 * 1024)
+    if cache_mb <= max_memory_mb:
+        overlay_frames = np.empty(shape, dtype=np.uint8)
+    else:
+        print(f"Overlay cache of {cache_mb:.0f} MB exceeds {max_memory_mb} MB, using a memory-mapped file instead.")
+        # The temporary file is deleted as soon as the mapping is closed
+        overlay_frames = np.memmap(tempfile.TemporaryFile(dir=cache_dir), dtype=np.uint8, mode="w+", shape=shape)
+
+    # Resizes each decoded frame straight into its slot of the cache
+    cached_frames = 0
+    while cached_frames < overlay_frame_count:
+        success, overlay_frame = overlay.read()
+        if not success:
+            break
+        cv2.resize(overlay_frame, (new_width, new_height), dst=overlay_frames[cached_frames])
+        cached_frames += 1
+    overlay.release()
+
+    if cached_frames == 0:
+        print(f"Error: Unable to read frames from the overlay video {overlay_path}")
+        return None
+    print(f"Cached {cached_frames} resized overlay frames.")
+    return overlay_frames[:cached_frames]
+
+# Places a resized overlay frame on the top left of a main frame
+def overlay_frame_on(main_frame, resized_overlay):
+    new_height, new_width = resized_overlay.shape[:2]
+
+    # Determine the position for the overlay (top-left corner)
+    main_height, main_width, _ = main_frame.shape
+    x_offset = 0  # Horizontal offset (top-left)
+    y_offset = 0  # Vertical offset (top-left)
+
+    # Ensure the overlay fits within the main frame
+    if y_offset + new_height > main_height or x_offset + new_width > main_width:
+        print("Error: Overlay size exceeds main frame dimensions.")
+        return None
+
+    # Place the overlay directly on the main frame
+    main_frame[y_offset:y_offset + new_height, x_offset:x_offset + new_width] = resized_overlay
+    return main_frame
+
+# Builds a per-frame overlay filter for the pipeline
+def make_overlay_filter(overlay_path, new_width, new_height, max_memory_mb=512, cache_dir=None, start_frame=0):
+    with stage("overlay_cache"):
+        overlay_frames = load_overlay_frames(overlay_path, new_width, new_height, max_memory_mb, cache_dir)
+    if overlay_frames is None:
+        return None
+    # The overlay keeps its place in the loop when the run starts part way into the video
+    state = {"frame_index": start_frame}
+
+    def overlay_filter(frame):
+        resized_overlay = overlay_frames[state["frame_index"] % len(overlay_frames)]
+        state["frame_index"] += 1
+        return overlay_frame_on(frame, resized_overlay)
+    return overlay_filter
+
+def getResolution():
     # Function to get the resolution from the user
     resolution = input("Enter the resolution (e.g., 1920x1080): ")
     return tuple(map(int, resolution.split("x")))
@@ -0,0 +1,240 @@
+import argparse
+import importlib
+import multiprocessing as mp
+import os
+import queue
+import shutil
+import tempfile
+import cv2
+from instrument import (add_profile_arguments, add_stage_times, enable_profiling, finish_profiling, profiling_enabled,
+                        stage, stage_times)
+from main import add_output_arguments, make_output_spec, output_spec_from_args, prep_video
+
+# Stateless filters that can run on any frame independently, as (module, factory) pairs
+# Overlay is not listed because the overlay frame depends on the position in the overlay video
+FILTER_FACTORIES = {
+    "night": ("detectNight", "make_brightness_filter"),
+    "blur": ("blurFaces", "make_blur_filter"),
+    "watermark": ("watermark", "make_watermark_filter"),
+}
+
+# Runs stateless per-frame filters in a process pool, one frame range (chunk) at a time per worker.
+# Every worker decodes, filters and encodes its chunks into lossless files of their own, so no worker ever waits
+# for the others, and the chunks are joined in order at the end through a single encode with the output codec
+# (see stitching.stitch_videos). The output is the same, byte for byte, as a serial run of the same filters
+# filter_specs is a list of (filter name, factory arguments), e.g. [("watermark", ("wm.png",))]
+# Returns the number of processed frames, or None if it failed
+def run_parallel(file_path, output_file_name, filter_specs, workers=None, chunk_size=120, output_spec=None):
+    from segments import OUTPUT_FOLDER
+    from stitching import stitch_videos
+
+    vid = cv2.VideoCapture(file_path)
+    if not vid.isOpened():
+        print(f"Error: Cannot open video file {file_path}")
+        return None
+    total_no_frames = int(vid.get(cv2.CAP_PROP_FRAME_COUNT))
+    vid.release()
+
+    if output_spec is None:
+        output_spec = make_output_spec()
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # Splits the video into frame ranges
+    chunks = [(start, min(start + chunk_size, total_no_frames)) for start in range(0, total_no_frames, chunk_size)]
+    workers = max(1, min(workers, len(chunks)))
+    print(f"Parallel processing of {len(chunks)} chunk(s) with {workers} worker(s)...\n")
+
+    # The chunk files go into a folder of their own in the processed files folder
+    base_name = os.path.basename(output_file_name.rsplit('.', 1)[0])
+    parts_dir = tempfile.mkdtemp(prefix=f"{base_name}.", suffix=".parallel", dir=OUTPUT_FOLDER)
+    chunk_spec = chunk_output_spec(output_spec)
+    chunk_names = [f"{os.path.basename(parts_dir)}/chunk{chunk_index:05d}.{chunk_spec['container']}"
+                   for chunk_index in range(len(chunks))]
+
+    ctx = mp.get_context("spawn")
+    task_queue = ctx.Queue()
+    done_queue = ctx.Queue()
+    for chunk_index, (start, end) in enumerate(chunks):
+        task_queue.put((chunk_index, start, end, chunk_names[chunk_index]))
+    for _ in range(workers):
+        task_queue.put(None)
+
+    filters = [(FILTER_FACTORIES[name], tuple(args)) for name, args in filter_specs]
+    # Workers time their own stages when profiling is on and send the totals back when they finish
+    profile = profiling_enabled()
+    processes = [ctx.Process(target=_worker,
+                             args=(worker_id, file_path, filters, chunk_spec, task_queue, done_queue, profile))
+                 for worker_id in range(workers)]
+    for process in processes:
+        process.start()
+
+    # Waits for every chunk, and the stage totals of every worker (CPU time, not wall time)
+    chunk_counts = {}
+    reported = 0
+    failed = False
+    try:
+        while len(chunk_counts) < len(chunks) or (profile and reported < workers):
+            with stage("wait_for_workers"):
+                message = _next_message(done_queue, processes)
+            if message is None or message[0] == "error":
+                failed = True
+                break
+            if message[0] == "chunk":
+                chunk_counts[message[1]] = message[2]
+            else:
+                add_stage_times(message[2])
+                reported += 1
+    finally:
+        if failed:
+            print("Error: A worker failed, stopping parallel processing.")
+            for process in processes:
+                process.terminate()
+        for process in processes:
+            process.join()
+
+    # Joins the chunks that have frames (the ones after the end of a shorter than announced video have none)
+    frame_count = None
+    chunk_paths = [OUTPUT_FOLDER + chunk_names[chunk_index] for chunk_index in range(len(chunks))
+                   if not failed and chunk_counts[chunk_index]]
+    if not failed and not chunk_paths:
+        print("Error: No frames could be read from the video.")
+    elif chunk_paths:
+        with stage("join"):
+            if stitch_videos(chunk_paths, output_file_name, output_spec) is not None:
+                frame_count = sum(chunk_counts.values())
+    shutil.rmtree(parts_dir)
+
+    if frame_count is not None:
+        print(f"Parallel processing complete. Processed {frame_count} frames. Video released.\n")
+    return frame_count
+
+# Output spec of the chunk files: lossless HuffYUV AVI at the output frame rate, so the frames are only compressed
+# with the output codec once, by one encoder in frame order (a fresh MJPG encoder per chunk would start every
+# chunk at a lower quality). HuffYUV encodes about as fast as MJPG, where FFV1 takes five times as long
+def chunk_output_spec(output_spec):
+    return dict(output_spec, fourcc="HFYU", container="avi", quality=None)
+
+# Waits for the next worker message, returning None if a worker died without reporting
+def _next_message(done_queue, processes):
+    while True:
+        try:
+            return done_queue.get(timeout=1)
+        except queue.Empty:
+            if any(process.exitcode not in (None, 0) for process in processes):
+                return None
+
+# Worker process: decodes, filters and encodes its chunks, each into its own chunk file
+def _worker(worker_id, file_path, filters, chunk_spec, task_queue, done_queue, profile=False):
+    # Each process already runs on its own core
+    cv2.setNumThreads(1)
+    if profile:
+        enable_profiling(f"worker {worker_id}")
+
+    # Builds the filter chain inside the process, since filters are closures and cannot be pickled
+    frame_filters = []
+    for (module_name, factory_name), args in filters:
+        factory = getattr(importlib.import_module(module_name), factory_name)
+        frame_filter = factory(*args)
+        if frame_filter is None:
+            done_queue.put(("error", worker_id))
+            return
+        frame_filters.append(frame_filter)
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        chunk_index, start, end, chunk_name = task
+
+        # Seeks to the first frame of the chunk
+        vid, out, _ = prep_video(file_path, chunk_name, output_spec=chunk_spec, start_frame=start)
+        if vid is None or out is None:
+            done_queue.put(("error", worker_id))
+            return
+        produced = 0
+        for _ in range(start, end):
+            success, frame = vid.read()
+            if not success:
+                break
+
+            for frame_filter in frame_filters:
+                with stage(frame_filter.__name__):
+                    frame = frame_filter(frame)
+                if frame is None:
+                    break
+            if frame is None:
+                vid.release()
+                out.release()
+                done_queue.put(("error", worker_id))
+                return
+            out.write(frame)
+            produced += 1
+        vid.release()
+        out.release()
+        done_queue.put(("chunk", chunk_index, produced))
+
+    if profile:
+        done_queue.put(("stages", worker_id, stage_times()))
+
+# Command line entry point, e.g.
+# python task-A/parallel.py in.mp4 out.avi --blur --watermark task-A/project-files-A/watermark1.png --workers 16
+def main(argv=None):
+    from blurFaces import ANONYMIZE_METHODS
+    from detectNight import TONE_CURVES
+    from watermark import WATERMARK_POSITIONS
+    parser = argparse.ArgumentParser(description="Run stateless task-A filters on several processes.")
+    parser.add_argument("input", help="path of video to process")
+    parser.add_argument("output", help="output file name (use .avi extension)")
+    parser.add_argument("--night", action="store_true", help="detect night and brighten the video")
+    parser.add_argument("--tone-curve", default="gain", choices=TONE_CURVES, help="how night videos are brightened")
+    parser.add_argument("--blur", action="store_true", help="blur faces in the video")
+    parser.add_argument("--anonymize", default="gaussian", choices=ANONYMIZE_METHODS,
+                        help="how detected faces are anonymized")
+    parser.add_argument("--watermark", metavar="PATH", help="watermark image to add")
+    parser.add_argument("--watermark-position", default="top-left", choices=WATERMARK_POSITIONS,
+                        help="where to place the watermark")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=120, help="number of frames per chunk")
+    add_output_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    output_spec = output_spec_from_args(args)
+    if output_spec is None:
+        return
+    if args.profile is not None or args.cprofile is not None:
+        enable_profiling(f"parallel {args.input}", args.cprofile)
+    try:
+        run_from_args(args, output_spec)
+    finally:
+        finish_profiling(args.profile)
+
+# Measures the night brightness if needed and runs the selected filters in parallel
+def run_from_args(args, output_spec):
+    filter_specs = []
+    if args.night:
+        # Measures the brightness (and histogram for the equalize curve) once here instead of in every worker
+        from detectNight import brightness_histogram, calculate_brightness
+        vid = cv2.VideoCapture(args.input)
+        if not vid.isOpened():
+            print(f"Error: Cannot open video file {args.input}")
+            return
+        histogram = None
+        with stage("brightness_scan"):
+            if args.tone_curve == "equalize":
+                vid_avg_brightness, histogram = brightness_histogram(vid)
+            else:
+                vid_avg_brightness = calculate_brightness(vid, int(vid.get(cv2.CAP_PROP_FRAME_COUNT)))
+        vid.release()
+        if vid_avg_brightness is None:
+            return
+        filter_specs.append(("night", (vid_avg_brightness, args.tone_curve, histogram)))
+    if args.blur:
+        filter_specs.append(("blur", (args.anonymize,)))
+    if args.watermark is not None:
+        filter_specs.append(("watermark", (args.watermark, args.watermark_position)))
+    run_parallel(args.input, args.output, filter_specs, args.workers, args.chunk_size, output_spec=output_spec)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import argparse
+import cv2
+from instrument import add_profile_arguments, enable_profiling, finish_profiling, stage
+from main import add_output_arguments, output_spec_from_args, prep_video
+
+# Runs several per-frame filters over one decode and one encode of the video
+# Only the frames from start_frame up to (not including) end_frame are processed, seeking to start_frame
+# Returns the number of processed frames, or None if the pipeline failed
+def run_pipeline(file_path, output_file_name, filters, append_path=None, threaded=False, queue_size=32,
+                 output_spec=None, start_frame=0, end_frame=None):
+    # Prepares the video for processing
+    vid, out, total_no_frames = prep_video(file_path, output_file_name, threaded, queue_size, output_spec, start_frame)
+
+    # Checks if the video was prepared successfully
+    if vid is None or out is None:
+        print("Error: Video preparation failed.")
+        return None
+    else:
+        print(f"Pipeline with {len(filters)} stage(s) in progress...\n")
+
+    # Stages that look ahead of the frame they get read through their own wrapper of the capture
+    # (see detectNight.make_lookahead_night_filter)
+    for frame_filter in filters:
+        if hasattr(frame_filter, "wrap_capture"):
+            vid = frame_filter.wrap_capture(vid)
+
+    frame_count = 0
+    failed = False
+    while end_frame is None or start_frame + frame_count < end_frame:
+        success, frame = vid.read()
+        if not success:
+            break  # Break if no frames are left
+
+        # Passes the frame through every stage in order
+        for frame_filter in filters:
+            with stage(frame_filter.__name__):
+                frame = frame_filter(frame)
+            if frame is None:
+                break
+        if frame is None:
+            print(f"Error: Pipeline stopped at frame count {frame_count}")
+            failed = True
+            break
+
+        # Writes the frame into the output video file
+        out.write(frame)
+        frame_count += 1
+
+    # Appends the ending screen (or another video) in the same encode
+    if append_path is not None:
+        from stitching import append_frames
+        stitch_vid = cv2.VideoCapture(append_path)
+        if not stitch_vid.isOpened():
+            print(f"Error: Cannot open video file {append_path}")
+            failed = True
+        else:
+            # Matches the frame size and frame rate of the processed video
+            frame_size = (int(vid.get(cv2.CAP_PROP_FRAME_WIDTH)), int(vid.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            fps = vid.get(cv2.CAP_PROP_FPS)
+            if output_spec is not None and output_spec["fps"] is not None:
+                fps = output_spec["fps"]
+            with stage("append"):
+                append_frames(stitch_vid, out, frame_size, fps)
+
+    # Releases the video for other use
+    vid.release()
+    out.release()
+    cv2.destroyAllWindows()
+    print(f"Pipeline complete. Processed {frame_count} frames. Video released.\n")
+    return None if failed else frame_count
+
+# Builds the filter list from the selected stages, in the order night, blur, overlay, watermark
+# start_frame is the frame number of the first frame the filters get
+# With night_lookahead (or night_adaptive, which looks NIGHT_LOOKAHEAD frames ahead by default) the night stage
+# decides from the frames ahead in the same capture instead of scanning the file first, so it works on streams
+def build_filters(file_path, night=False, blur=False, overlay_path=None, resolution=None, watermark_path=None,
+                  night_sample_every=1, night_downscale=1, watermark_position="top-left",
+                  detect_every=1, detect_downscale=1, tracker_type="hold", keep_alive=0, anonymize_method="gaussian",
+                  overlay_cache_mb=512, cache_dir=None, face_index=None, start_frame=0, tone_curve="gain",
+                  night_lookahead=None, night_adaptive=False):
+    filters = []
+    if night and (night_lookahead is not None or night_adaptive):
+        from detectNight import NIGHT_LOOKAHEAD, make_lookahead_night_filter
+        filters.append(make_lookahead_night_filter(NIGHT_LOOKAHEAD if night_lookahead is None else night_lookahead,
+                                                   night_adaptive, tone_curve))
+    elif night:
+        from detectNight import make_night_filter
+        filters.append(make_night_filter(file_path, night_sample_every, night_downscale, tone_curve))
+    if blur:
+        from blurFaces import make_blur_filter, make_tracking_blur_filter
+        if face_index is not None:
+            # Blurs the boxes of the face index, or records the detected ones into it
+            from faceIndex import make_index_blur_filter
+            filters.append(make_index_blur_filter(face_index, anonymize_method, detect_every, detect_downscale,
+                                                  tracker_type, keep_alive, start_frame=start_frame))
+        elif detect_every == 1 and detect_downscale == 1:
+            filters.append(make_blur_filter(anonymize_method))
+        else:
+            filters.append(make_tracking_blur_filter(detect_every, detect_downscale, tracker_type, keep_alive,
+                                                     anonymize_method, start_frame=start_frame))
+    if overlay_path is not None:
+        from overlay import make_overlay_filter
+        new_width, new_height = resolution
+        filters.append(make_overlay_filter(overlay_path, new_width, new_height, overlay_cache_mb, cache_dir, start_frame))
+    if watermark_path is not None:
+        from watermark import make_watermark_filter
+        filters.append(make_watermark_filter(watermark_path, watermark_position))
+
+    # A stage that failed to load returns None
+    if any(frame_filter is None for frame_filter in filters):
+        print("Error: Failed to set up one of the pipeline stages.")
+        return None
+    return filters
+
+# Gets user input for the stages to chain in the menu
+def get_pipeline_input(file_path):
+    night = input("Detect night and brighten? (y/n): ").lower() == 'y'
+    blur = input("Blur faces? (y/n): ").lower() == 'y'
+    overlay_path, resolution = None, None
+    if input("Overlay a video? (y/n): ").lower() == 'y':
+        from overlay import getOverlayPath, getResolution
+        overlay_path = getOverlayPath()
+        resolution = getResolution()
+    watermark_path = None
+    if input("Add a watermark? (y/n): ").lower() == 'y':
+        from watermark import enter_watermark
+        watermark_path = enter_watermark()
+    append_path = None
+    if input("Append a video at the end? (y/n): ").lower() == 'y':
+        append_path = input("Enter path of video to stitch: ")
+    filters = build_filters(file_path, night, blur, overlay_path, resolution, watermark_path)
+    return filters, append_path
+
+# Parses a "WIDTHxHEIGHT" string into a tuple
+def parse_resolution(resolution):
+    return tuple(map(int, resolution.split("x")))
+
+# Builds the command line parser, also used for the jobs of batch.py
+def build_parser():
+    from blurFaces import ANONYMIZE_METHODS, TRACKER_TYPES
+    from detectNight import NIGHT_LOOKAHEAD, TONE_CURVES
+    from watermark import WATERMARK_POSITIONS
+    parser = argparse.ArgumentParser(description="Chain task-A filters over a single decode and encode.")
+    parser.add_argument("input", help="path of video to process")
+    parser.add_argument("output", help="output file name (use .avi extension)")
+    parser.add_argument("--night", action="store_true", help="detect night and brighten the video")
+    parser.add_argument("--night-sample-every", type=int, default=1, metavar="N",
+                        help="estimate the night brightness from every Nth frame only")
+    parser.add_argument("--night-downscale", type=int, default=1, metavar="F",
+                        help="downscale frames by F before estimating the night brightness")
+    parser.add_argument("--tone-curve", default="gain", choices=TONE_CURVES, help="how night videos are brightened")
+    parser.add_argument("--night-lookahead", type=int, default=None, metavar="N",
+                        help="decide night from the first N+1 frames while processing, without scanning the file "
+                             "first (works on pipes and streams)")
+    parser.add_argument("--night-adaptive", action="store_true",
+                        help="follow the brightness of the next N frames along the video, ramping the gain "
+                             f"(N is {NIGHT_LOOKAHEAD} unless --night-lookahead is given)")
+    parser.add_argument("--blur", action="store_true", help="blur faces in the video")
+    parser.add_argument("--anonymize", default="gaussian", choices=ANONYMIZE_METHODS,
+                        help="how detected faces are anonymized")
+    parser.add_argument("--detect-every", type=int, default=1, metavar="N", help="detect faces on every Nth frame only")
+    parser.add_argument("--detect-downscale", type=float, default=1, metavar="F",
+                        help="downscale frames by F before detecting faces")
+    parser.add_argument("--tracker", default="hold", choices=TRACKER_TYPES,
+                        help="how face boxes follow the faces between detections")
+    parser.add_argument("--keep-alive", type=int, default=0, metavar="N",
+                        help="keep blurring a face for N frames after the detector loses it")
+    parser.add_argument("--face-index", nargs="?", const="", default=None, metavar="PATH",
+                        help="reuse the face boxes saved in this index, or save them there (default: next to the input)")
+    parser.add_argument("--overlay", metavar="PATH", help="video to overlay on the top left")
+    parser.add_argument("--resolution", type=parse_resolution, default=(320, 180), help="overlay resolution, e.g. 320x180")
+    parser.add_argument("--overlay-cache-mb", type=int, default=512,
+                        help="largest in-memory overlay cache before it moves to a memory-mapped file")
+    parser.add_argument("--cache-dir", default=None, help="directory for the memory-mapped overlay cache")
+    parser.add_argument("--watermark", metavar="PATH", help="watermark image to add")
+    parser.add_argument("--watermark-position", default="top-left", choices=WATERMARK_POSITIONS,
+                        help="where to place the watermark")
+    parser.add_argument("--append", metavar="PATH", help="video to append at the end")
+    parser.add_argument("--start", default=None, metavar="POSITION",
+                        help="first frame to process, as a frame number or a time (90s, 1:30, 0:01:30.5)")
+    parser.add_argument("--end", default=None, metavar="POSITION", help="stop before this frame or time")
+    parser.add_argument("--segment-frames", type=int, default=None, metavar="N",
+                        help="write the output as chunks of N frames with a progress manifest, resuming a "
+                             "previous run of the same job, and join them at the end")
+    parser.add_argument("--keep-segments", action="store_true", help="keep the chunks and manifest after joining")
+    parser.add_argument("--threaded", action="store_true", help="decode and encode on background threads")
+    parser.add_argument("--queue-size", type=int, default=32, help="frames buffered by each background thread")
+    add_output_arguments(parser)
+    add_profile_arguments(parser)
+    return parser
+
+# Runs the pipeline for parsed command line options, profiled if --profile or --cprofile is given
+# Returns the number of processed frames, or None if it failed
+def run_from_args(args):
+    if args.profile is not None or args.cprofile is not None:
+        enable_profiling(f"pipeline {args.input}", args.cprofile)
+    try:
+        return run_stages_from_args(args)
+    finally:
+        finish_profiling(args.profile)
+
+# Builds and runs the stages selected by parsed command line options
+def run_stages_from_args(args):
+    output_spec = output_spec_from_args(args)
+    if output_spec is None:
+        return None
+
+    # Without any filter this is a plain stitch, which can skip decoding
+    stages = [args.night, args.blur, args.overlay is not None, args.watermark is not None]
+    ranged = args.start is not None or args.end is not None
+    if args.append is not None and not any(stages) and not ranged and args.segment_frames is None:
+        from stitching import stitch_videos
+        return stitch_videos([args.input, args.append], args.output, output_spec)
+
+    start_frame, end_frame = 0, None
+    if ranged:
+        from segments import frame_range
+        start_frame, end_frame = frame_range(args.input, args.start, args.end)
+        if start_frame is None:
+            return None
+
+    face_index, index_path = None, None
+    if args.blur and args.face_index is not None:
+        from faceIndex import default_index_path, open_face_index
+        index_path = args.face_index or default_index_path(args.input)
+        face_index = open_face_index(args.input, index_path, args.detect_every, args.detect_downscale, args.tracker,
+                                     args.keep_alive)
+
+    # Filters for a run whose first frame is first_frame
+    def make_filters(first_frame):
+        return build_filters(args.input, args.night, args.blur, args.overlay, args.resolution, args.watermark,
+                             args.night_sample_every, args.night_downscale, args.watermark_position,
+                             args.detect_every, args.detect_downscale, args.tracker, args.keep_alive, args.anonymize,
+                             args.overlay_cache_mb, args.cache_dir, face_index, first_frame, args.tone_curve,
+                             args.night_lookahead, args.night_adaptive)
+
+    if args.segment_frames is not None:
+        from segments import run_segmented
+        # Everything that changes the output pixels has to match for a previous run to be resumed
+        settings = {key: value for key, value in vars(args).items()
+                    if key not in ("output", "profile", "cprofile", "threaded", "queue_size", "keep_segments")}
+        frame_count, resumed = run_segmented(args.input, args.output, make_filters, args.segment_frames, settings,
+                                             start_frame, end_frame, args.append, args.threaded, args.queue_size,
+                                             output_spec, args.keep_segments)
+    else:
+        filters = make_filters(start_frame)
+        if filters is None:
+            return None
+        frame_count = run_pipeline(args.input, args.output, filters, args.append, args.threaded, args.queue_size,
+                                   output_spec, start_frame, end_frame)
+        resumed = False
+
+    # Only a complete run from the first frame leaves boxes for every frame
+    if frame_count is not None and face_index is not None and face_index["recording"] and ranged:
+        print("Face index not saved, since only part of the video was processed.")
+    elif frame_count is not None and face_index is not None and face_index["recording"] and not resumed:
+        from faceIndex import save_face_index
+        save_face_index(face_index, index_path)
+    return frame_count
+
+# Command line entry point, e.g.
+# python task-A/pipeline.py in.mp4 out.avi --night --blur --watermark task-A/project-files-A/watermark1.png
+def main(argv=None):
+    run_from_args(build_parser().parse_args(argv))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import json
+import os
+import cv2
+from instrument import stage
+
+# Segmented output for long pipeline runs, e.g.
+# python task-A/pipeline.py long.mp4 long.avi --blur --segment-frames 1800
+#
+# The output is written as chunk files of a fixed number of frames into task-A/processed-files-A/<output>.parts/,
+# next to a manifest.json that records the job and every finished chunk. Running the same job again (same input
+# file, settings, frame range and chunk length) resumes after the last finished chunk instead of starting from
+# the first frame; any other job starts over. Once every chunk is done they are joined into the output, without
+# re-encoding for MJPG AVI (see stitching.stitch_videos), and removed unless they are kept.
+
+# Folder of the processed videos, as used by main.get_output_path
+OUTPUT_FOLDER = "task-A/processed-files-A/"
+
+# Converts a position into a frame number at the given frame rate. A position is a frame number ("1500"),
+# a time in seconds ("90s", "90.5s") or a time as minutes:seconds or hours:minutes:seconds ("1:30", "0:01:30.5")
+def position_to_frame(position, fps):
+    if position.endswith("s"):
+        seconds = float(position[:-1])
+    elif ":" in position:
+        seconds = 0.0
+        for part in position.split(":"):
+            seconds = seconds * 60 + float(part)
+    else:
+        return int(position)
+    return int(round(seconds * fps))
+
+# Converts start and end positions in a video into frame numbers
+# Returns (start_frame, end_frame), with end_frame None for the end of the video, or (None, None) if they are invalid
+def frame_range(file_path, start=None, end=None):
+    vid = cv2.VideoCapture(file_path)
+    if not vid.isOpened():
+        print(f"Error: Cannot open video file {file_path}")
+        return None, None
+    fps = vid.get(cv2.CAP_PROP_FPS)
+    vid.release()
+    if fps <= 0:
+        fps = 30.0
+
+    try:
+        start_frame = 0 if start is None else position_to_frame(start, fps)
+        end_frame = None if end is None else position_to_frame(end, fps)
+    except ValueError:
+        print(f"Error: Invalid start or end position ({start}, {end}).")
+        return None, None
+    if start_frame < 0 or (end_frame is not None and end_frame <= start_frame):
+        print("Error: The end position must come after the start position.")
+        return None, None
+    return start_frame, end_frame
+
+# Loads a segment manifest, or returns None if there is none or it cannot be read
+def load_segment_manifest(manifest_path):
+    try:
+        with open(manifest_path) as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+
+# Saves a segment manifest, replacing the previous one only once the new one is completely written
+def save_segment_manifest(manifest, manifest_path):
+    with open(manifest_path + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+# Removes the chunk files of a manifest
+def remove_chunks(manifest, parts_dir):
+    for chunk in manifest["chunks"]:
+        chunk_path = os.path.join(parts_dir, chunk["file"])
+        if os.path.exists(chunk_path):
+            os.remove(chunk_path)
+
+# Runs the pipeline over the frames [start_frame, end_frame) as chunks of segment_frames frames, resuming a previous
+# run of the same job from its manifest, then joins the chunks (followed by append_path) into the output
+# make_filters(first_frame) builds the filters for a run whose first frame is first_frame
+# settings holds everything besides the input that decides the output, to tell whether a manifest is of this job
+# Returns (number of processed frames, or None if it failed, and whether finished chunks of an earlier run were used)
+def run_segmented(file_path, output_file_name, make_filters, segment_frames, settings, start_frame=0, end_frame=None,
+                  append_path=None, threaded=False, queue_size=32, output_spec=None, keep_segments=False):
+    from main import make_output_spec
+    from pipeline import run_pipeline
+    from stitching import stitch_videos
+
+    if output_spec is None:
+        output_spec = make_output_spec()
+    if segment_frames < 1:
+        print("Error: Chunks need at least one frame.")
+        return None, False
+
+    vid = cv2.VideoCapture(file_path)
+    if not vid.isOpened():
+        print(f"Error: Cannot open video file {file_path}")
+        return None, False
+    total_no_frames = int(vid.get(cv2.CAP_PROP_FRAME_COUNT))
+    vid.release()
+    end_frame = total_no_frames if end_frame is None else min(end_frame, total_no_frames)
+    if start_frame >= end_frame:
+        print("Error: No frames to process in the given range.")
+        return None, False
+
+    base_name = output_file_name.rsplit('.', 1)[0]
+    parts_name = f"{base_name}.parts"
+    parts_dir = OUTPUT_FOLDER + parts_name
+    manifest_path = os.path.join(parts_dir, "manifest.json")
+
+    # The job as it reads back from the manifest (tuples become lists)
+    job = json.loads(json.dumps({"input": os.path.abspath(file_path), "input_size": os.path.getsize(file_path),
+                                 "input_mtime": os.path.getmtime(file_path), "settings": settings,
+                                 "output_spec": output_spec, "start_frame": start_frame, "end_frame": end_frame,
+                                 "segment_frames": segment_frames}))
+
+    manifest = load_segment_manifest(manifest_path)
+    if manifest is None or manifest.get("job") != job:
+        if manifest is not None:
+            print(f"The chunks in {parts_dir} are of another job, starting over.")
+            remove_chunks(manifest, parts_dir)
+        chunks = [{"start": chunk_start, "end": min(chunk_start + segment_frames, end_frame),
+                   "file": f"{os.path.basename(base_name)}_part{chunk_index:05d}.{output_spec['container']}",
+                   "frames": None}
+                  for chunk_index, chunk_start in enumerate(range(start_frame, end_frame, segment_frames))]
+        manifest = {"job": job, "chunks": chunks}
+        os.makedirs(parts_dir, exist_ok=True)
+        save_segment_manifest(manifest, manifest_path)
+    chunks = manifest["chunks"]
+
+    # Chunks run in order, so everything from the first unfinished one is run again
+    first_pending = next((chunk_index for chunk_index, chunk in enumerate(chunks)
+                          if chunk["frames"] is None or not os.path.exists(os.path.join(parts_dir, chunk["file"]))),
+                         len(chunks))
+    resumed = first_pending > 0
+    if resumed and first_pending < len(chunks):
+        print(f"Resuming at chunk {first_pending + 1} of {len(chunks)} (frame {chunks[first_pending]['start']}).\n")
+
+    # The filters carry on from one chunk to the next, as in a single run
+    filters = None
+    for chunk_index in range(first_pending, len(chunks)):
+        chunk = chunks[chunk_index]
+        if filters is None:
+            filters = make_filters(chunk["start"])
+            if filters is None:
+                return None, resumed
+
+        # Drops what an interrupted run left of this chunk, so it gets the same file name again
+        chunk_path = os.path.join(parts_dir, chunk["file"])
+        if os.path.exists(chunk_path):
+            os.remove(chunk_path)
+        chunk["frames"] = None
+        frames = run_pipeline(file_path, f"{parts_name}/{chunk['file']}", filters, None, threaded, queue_size,
+                              output_spec, chunk["start"], chunk["end"])
+        if frames is None:
+            save_segment_manifest(manifest, manifest_path)
+            print(f"Error: Chunk {chunk_index + 1} of {len(chunks)} failed, run the job again to resume it.")
+            return None, resumed
+        chunk["frames"] = frames
+
+        # The video ended before the frame count said it would
+        if frames < chunk["end"] - chunk["start"]:
+            for later_chunk in chunks[chunk_index + 1:]:
+                later_chunk["frames"] = 0
+        save_segment_manifest(manifest, manifest_path)
+        print(f"Chunk {chunk_index + 1} of {len(chunks)} done ({frames} frames).\n")
+        if frames < chunk["end"] - chunk["start"]:
+            break
+
+    # Joins the chunks that have frames, followed by the appended video
+    chunk_paths = [os.path.join(parts_dir, chunk["file"]) for chunk in chunks if chunk["frames"]]
+    if not chunk_paths:
+        print("Error: No frames could be read in the given range.")
+        return None, resumed
+    with stage("join"):
+        joined = stitch_videos(chunk_paths + ([append_path] if append_path is not None else []), output_file_name,
+                               output_spec)
+    if joined is None:
+        print(f"Error: Joining the chunks failed, they are kept in {parts_dir}.")
+        return None, resumed
+
+    if not keep_segments:
+        remove_chunks(manifest, parts_dir)
+        os.remove(manifest_path)
+        os.rmdir(parts_dir)
+    frame_count = sum(chunk["frames"] for chunk in chunks)
+    print(f"Segmented run complete. Processed {frame_count} frames in {len(chunk_paths)} chunk(s).\n")
+    return frame_count, resumed
@@ -1,48 +1,117 @@
 import cv2
+from instrument import count, stage
 
 # Function to stitch a video to other videos
-def stitching(file_path, output_file_name):
-    from main import prep_video
-    # Prepares the video for processing
-    vid, out, total_no_frames = prep_video(file_path, output_file_name)
+# stitch_file_path is asked for when not given
+def stitching(file_path, output_file_name, stitch_file_path=None):
+    # Gets endscreen file path (or another video to stitch)
+    if stitch_file_path is None:
+        stitch_file_path = input("Enter path of video to stitch: ")
+    stitch_videos([file_path, stitch_file_path], output_file_name)
+
+# Stitches any number of videos one after another into a single output video
+# MJPG AVI inputs with the same frame size and frame rate are joined without decoding (stream copy),
+# anything else is decoded and the later clips are resized and resampled to match the first one
+# output_spec (see main.make_output_spec) sets the codec of the output, the fast path needs plain MJPG AVI
+# Returns the number of frames written, or None if it failed
+def stitch_videos(file_paths, output_file_name, output_spec=None):
+    from main import get_output_path, make_output_spec, prep_video
+    from aviRemux import avi_compatible, fits_plain_avi, read_avi_index, remux_avi
+
+    if output_spec is None:
+        output_spec = make_output_spec()
+
+    # Fast path: copies the compressed frames straight into the output file
+    copyable = (output_spec["fourcc"] == "MJPG" and output_spec["container"] == "avi"
+                and output_spec["quality"] is None and output_spec["fps"] is None)
+    if copyable and all(path.lower().endswith(".avi") for path in file_paths):
+        infos = [read_avi_index(path) for path in file_paths]
+        if avi_compatible(infos) and fits_plain_avi(infos):
+            print("Stitching compatible MJPG videos without re-encoding...\n")
+            output_path = get_output_path(output_file_name.rsplit('.', 1)[0] + ".avi")
+            with stage("remux"):
+                frame_count = remux_avi(infos, output_path)
+            count("frames", frame_count)
+            print(f"Stitching complete. Copied {frame_count} frames.\n")
+            return frame_count
+
+    # Prepares the first video for processing
+    vid, out, total_no_frames = prep_video(file_paths[0], output_file_name, output_spec=output_spec)
 
     # Checks if the video was prepared successfully
     if vid is None or out is None:
         print("Error: Video preparation failed.")
-        return
-    
-    # Gets endscreen file path (or another video to stitch)
-    stitch_file_path = input("Enter path of video to stitch: ")
-    stitch_vid = cv2.VideoCapture(stitch_file_path)
-
-    # Checks if the endscreen video was opened successfully
-    if not stitch_vid.isOpened():
-        print(f"Error: Cannot open video file {stitch_file_path}")
-        return
-    else: 
-        print("Stitching in progress...\n")
-    
+        return None
+
+    # Every later clip is converted to the frame size and frame rate of the first one
+    frame_size = (int(vid.get(cv2.CAP_PROP_FRAME_WIDTH)), int(vid.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    fps = output_spec["fps"] or vid.get(cv2.CAP_PROP_FPS)
+
+    # Checks if the other videos can be opened
+    stitch_vids = []
+    for stitch_file_path in file_paths[1:]:
+        stitch_vid = cv2.VideoCapture(stitch_file_path)
+        if not stitch_vid.isOpened():
+            print(f"Error: Cannot open video file {stitch_file_path}")
+            vid.release()
+            out.release()
+            return None
+        stitch_vids.append(stitch_vid)
+    print("Stitching in progress...\n")
+
     # Writes frames from the main video to the output file
+    written_frames = 0
     for frame_count in range(0, int(total_no_frames)):
         success, frame = vid.read()
         if not success:
             print(f"Error: Cannot read the frame at frame count {frame_count}")
             break
-        
+
         # Writes the frame into the output video file
         out.write(frame)
+        written_frames += 1
+
+    # Writes frames from the endscreen video(s) to the output file
+    for stitch_vid in stitch_vids:
+        with stage("append"):
+            written_frames += append_frames(stitch_vid, out, frame_size, fps)
+
+    # Releases the video for other use
+    vid.release()
+    out.release()
+    cv2.destroyAllWindows()
+    print("Stitching complete. Video released.\n")
+    return written_frames
+
+# Writes every remaining frame of an opened video to the output file
+# If frame_size and fps are given, the frames are resized and dropped/repeated to match them
+# Returns the number of frames written
+def append_frames(stitch_vid, out, frame_size=None, fps=None):
+    source_fps = stitch_vid.get(cv2.CAP_PROP_FPS)
+    resample = fps is not None and source_fps > 0 and abs(source_fps - fps) > 1e-3
+    if resample:
+        print(f"Resampling appended video from {source_fps:.2f} to {fps:.2f} FPS.")
 
-    # Writes frames from the endscreen video to the output file
+    source_count = 0
+    output_count = 0
     while True:
         success, frame = stitch_vid.read()
         if not success:
             break  # Break if no frames are left
-        
+        source_count += 1
+
+        if frame_size is not None and (frame.shape[1], frame.shape[0]) != frame_size:
+            frame = cv2.resize(frame, frame_size, interpolation=cv2.INTER_AREA)
+
         # Writes the frame into the output video file
-        out.write(frame)
+        if not resample:
+            out.write(frame)
+            output_count += 1
+            continue
 
-    # Releases the video for other use
-    vid.release()
-    out.release()
-    cv2.destroyAllWindows()
-    print("Stitching complete. Video released.\n")
\ No newline at end of file
+        # Writes the frame once for every output time step that falls before the next source frame
+        while output_count * source_fps < source_count * fps:
+            out.write(frame)
+            output_count += 1
+    stitch_vid.release()
+    return output_count
@@ -0,0 +1,125 @@
+import queue
+import threading
+import cv2
+
+# Wraps a cv2.VideoCapture with a background thread that decodes ahead into a bounded queue
+# OpenCV releases the GIL while decoding, so decoding overlaps with the processing on the main thread
+class ThreadedCapture:
+    def __init__(self, vid, queue_size=32):
+        self.vid = vid
+        self.queue_size = queue_size
+        self.depth_total = 0
+        self.reads = 0
+        self.empty_reads = 0
+        self._start()
+
+    def _start(self):
+        self.frames = queue.Queue(maxsize=self.queue_size)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._reader, daemon=True)
+        self.thread.start()
+
+    def _stop(self):
+        self.stopped.set()
+        # Unblocks the reader if it is waiting on a full queue
+        while self.thread.is_alive():
+            try:
+                self.frames.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.thread.join()
+
+    def _reader(self):
+        while not self.stopped.is_set():
+            success, frame = self.vid.read()
+            # Keeps trying to hand the frame over unless asked to stop
+            while not self.stopped.is_set():
+                try:
+                    self.frames.put((success, frame), timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if not success:
+                break
+
+    def read(self):
+        # Records how many decoded frames were waiting, to spot a decode bottleneck
+        depth = self.frames.qsize()
+        self.depth_total += depth
+        self.reads += 1
+        if depth == 0:
+            self.empty_reads += 1
+
+        success, frame = self.frames.get()
+        if not success:
+            # Keeps returning the end of the video on later reads
+            self.frames.put((False, None))
+        return success, frame
+
+    def set(self, prop_id, value):
+        # Seeking needs the reader stopped and the prefetched frames dropped
+        if prop_id == cv2.CAP_PROP_POS_FRAMES:
+            self._stop()
+            result = self.vid.set(prop_id, value)
+            self._start()
+            return result
+        return self.vid.set(prop_id, value)
+
+    def get(self, prop_id):
+        return self.vid.get(prop_id)
+
+    def isOpened(self):
+        return self.vid.isOpened()
+
+    def release(self):
+        self._stop()
+        self.vid.release()
+        print_queue_report("Decode", self.depth_total, self.reads, self.empty_reads, self.queue_size, "empty")
+
+# Wraps a cv2.VideoWriter with a background thread that encodes frames from a bounded queue
+class ThreadedWriter:
+    def __init__(self, out, queue_size=32):
+        self.out = out
+        self.queue_size = queue_size
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.depth_total = 0
+        self.writes = 0
+        self.full_writes = 0
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    def _writer(self):
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            self.out.write(frame)
+
+    def write(self, frame):
+        # Records how many frames were waiting to be encoded, to spot an encode bottleneck
+        depth = self.frames.qsize()
+        self.depth_total += depth
+        self.writes += 1
+        if depth >= self.queue_size:
+            self.full_writes += 1
+
+        # The frame must not be changed by the caller after this point
+        self.frames.put(frame)
+
+    def isOpened(self):
+        return self.out.isOpened()
+
+    def release(self):
+        self.frames.put(None)
+        self.thread.join()
+        self.out.release()
+        print_queue_report("Encode", self.depth_total, self.writes, self.full_writes, self.queue_size, "full")
+
+# Prints the average queue depth and how often the queue was empty/full when the main thread used it
+# A decode queue that is mostly empty means decoding is the bottleneck,
+# an encode queue that is mostly full means encoding is the bottleneck, otherwise the processing is
+def print_queue_report(stage, depth_total, count, stalled, queue_size, stalled_name):
+    if count == 0:
+        return
+    print(f"{stage} queue: average depth {depth_total / count:.1f}/{queue_size}, "
+          f"{stalled_name} on {100 * stalled / count:.0f}% of {count} frames")
@@ -1,17 +1,53 @@
 import cv2
 import numpy as np
+from instrument import stage
 from main import prep_video
 
-def add_watermark(video_path, output_file_name):
+# watermark_path is asked for when not given
+def add_watermark(video_path, output_file_name, position="top-left", watermark_path=None):
     # Prepare the video file for processing
     vid, out, total_frames = prep_video(video_path, output_file_name)
 
     # Load the watermark image
-    watermark_path = enter_watermark()
+    if watermark_path is None:
+        watermark_path = enter_watermark()
+    overlay, alpha = load_watermark(watermark_path)
+    if overlay is None:
+        return
+
+    # Prepare the blend once for the frame size of the video
+    frame_height = int(vid.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    frame_width = int(vid.get(cv2.CAP_PROP_FRAME_WIDTH))
+    blend = prepare_watermark(overlay, alpha, frame_height, frame_width, position)
+    if blend is None:
+        vid.release()
+        out.release()
+        return
+
+    # Loop through each frame of the video
+    for frame_index in range(total_frames):
+        ret, frame = vid.read()
+        if not ret:
+            print(f"Finished processing {frame_index} frames.")
+            break
+
+        with stage("watermark_blend"):
+            frame = blend_watermark(frame, blend)
+
+        # Write the processed frame to the output video
+        out.write(frame)
+
+    # Release resources
+    vid.release()
+    out.release()
+    print(f"Watermarked video saved as {output_file_name}.")
+
+# Loads the watermark image and splits it into colour channels and an alpha mask
+def load_watermark(watermark_path):
     watermark = cv2.imread(watermark_path, cv2.IMREAD_UNCHANGED)
     if watermark is None:
         print("Error: Cannot open watermark file")
-        return
+        return None, None
 
     # Ensure watermark has an alpha channel, or create one
     if watermark.shape[2] == 4:
@@ -22,43 +58,85 @@ def add_watermark(video_path, output_file_name):
         # Create an alpha mask: make black (0,0,0) fully transparent, others opaque
         alpha = cv2.inRange(overlay, (0, 0, 0), (0, 0, 0))  # Treat non-black as opaque
         alpha = cv2.bitwise_not(alpha)  # Invert so black becomes transparent
+    return overlay, alpha
 
-    # Loop through each frame of the video
-    for frame_index in range(total_frames):
-        ret, frame = vid.read()
-        if not ret:
-            print(f"Finished processing {frame_index} frames.")
-            break
+# Placement presets for the watermark
+WATERMARK_POSITIONS = ("top-left", "top-right", "bottom-left", "bottom-right", "center")
 
-        # Get frame and watermark dimensions
-        frame_height, frame_width = frame.shape[:2]
-        overlay_height, overlay_width = overlay.shape[:2]
+# Precomputes everything the per-frame blend needs for a given frame size:
+# the premultiplied overlay, the inverse alpha and scratch buffers, all limited to the
+# bounding box of the non-transparent watermark pixels
+def prepare_watermark(overlay, alpha, frame_height, frame_width, position="top-left"):
+    overlay_height, overlay_width = overlay.shape[:2]
 
-        # Ensure the watermark fits within the video frame
-        if overlay_height > frame_height or overlay_width > frame_width:
-            print("Error: Watermark is larger than the video frame.")
-            break
+    # Ensure the watermark fits within the video frame
+    if overlay_height > frame_height or overlay_width > frame_width:
+        print("Error: Watermark is larger than the video frame.")
+        return None
 
-        # Determine position for the watermark (top-left by default)
+    # Determine position for the watermark
+    if position == "top-left":
         x_offset, y_offset = 0, 0
+    elif position == "top-right":
+        x_offset, y_offset = frame_width - overlay_width, 0
+    elif position == "bottom-left":
+        x_offset, y_offset = 0, frame_height - overlay_height
+    elif position == "bottom-right":
+        x_offset, y_offset = frame_width - overlay_width, frame_height - overlay_height
+    elif position == "center":
+        x_offset, y_offset = (frame_width - overlay_width) // 2, (frame_height - overlay_height) // 2
+    else:
+        print(f"Error: Unknown watermark position {position}. Use one of {', '.join(WATERMARK_POSITIONS)}.")
+        return None
 
-        # Define the region of interest (ROI) on the frame
-        roi = frame[y_offset:y_offset + overlay_height, x_offset:x_offset + overlay_width]
+    # Fully transparent pixels leave the frame unchanged, so only the bounding box of the rest is blended
+    box_x, box_y, box_width, box_height = cv2.boundingRect(alpha)
+    box_alpha = alpha[box_y:box_y + box_height, box_x:box_x + box_width, np.newaxis].astype(np.uint16)
+    premultiplied = overlay[box_y:box_y + box_height, box_x:box_x + box_width].astype(np.uint16) * box_alpha
+    inverse_alpha = 255 - box_alpha
 
-        # Combine the watermark with the frame using the alpha channel
-        for c in range(3):  # Apply to each color channel (B, G, R)
-            roi[:, :, c] = roi[:, :, c] * (1 - alpha / 255.0) + overlay[:, :, c] * (alpha / 255.0)
+    # Scratch buffers reused for every frame
+    blended = np.empty(premultiplied.shape, dtype=np.uint16)
+    carry = np.empty(premultiplied.shape, dtype=np.uint16)
+    return y_offset + box_y, x_offset + box_x, premultiplied, inverse_alpha, blended, carry
 
-        # Replace the ROI in the frame with the combined result
-        frame[y_offset:y_offset + overlay_height, x_offset:x_offset + overlay_width] = roi
+# Blends the prepared watermark into a single frame in place
+def blend_watermark(frame, blend):
+    y_offset, x_offset, premultiplied, inverse_alpha, blended, carry = blend
+    height, width = premultiplied.shape[:2]
 
-        # Write the processed frame to the output video
-        out.write(frame)
+    # Define the region of interest (ROI) on the frame
+    roi = frame[y_offset:y_offset + height, x_offset:x_offset + width]
 
-    # Release resources
-    vid.release()
-    out.release()
-    print(f"Watermarked video saved as {output_file_name}.")
+    # roi * (255 - alpha) + overlay * alpha for all channels at once, which fits in uint16
+    np.multiply(roi, inverse_alpha, out=blended)
+    blended += premultiplied
+
+    # Divides by 255 in fixed point: floor(v / 255) == (v + 1 + (v >> 8)) >> 8 for every v up to 255 * 255
+    np.right_shift(blended, 8, out=carry)
+    blended += carry
+    blended += 1
+    blended >>= 8
+    roi[...] = blended
+    return frame
+
+# Builds a per-frame watermark filter for the pipeline
+def make_watermark_filter(watermark_path, position="top-left"):
+    overlay, alpha = load_watermark(watermark_path)
+    if overlay is None:
+        return None
+
+    # The blend is prepared once for the frame size of the video
+    blends = {}
+
+    def watermark_filter(frame):
+        frame_size = frame.shape[:2]
+        if frame_size not in blends:
+            blends[frame_size] = prepare_watermark(overlay, alpha, frame_size[0], frame_size[1], position)
+        if blends[frame_size] is None:
+            return None
+        return blend_watermark(frame, blends[frame_size])
+    return watermark_filter
 
 def enter_watermark():
     return input("Enter the path of the watermark image: ")
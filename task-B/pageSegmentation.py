@@ -0,0 +1,683 @@
+# Paragraph extraction for the task-B pages. Run it with task-B/task-B.py, or import it with task-B on the import
+# path to segment pages held in memory, e.g.
+#
+#   from pageSegmentation import iter_pages
+#   for page in iter_pages([("scan-17", png_bytes), ("scan-18", bgr_array)]):
+#       for file_name, crop in page["paragraphs"]:
+#           ...
+#
+# Importing it has no side effects. Stages are timed with the task-A profiling helpers when task-A is on the
+# import path too (task-B.py puts it there), and cost nothing otherwise.
+import argparse
+import contextlib
+import glob
+import json
+import multiprocessing as mp
+import os
+import re
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial
+import cv2
+import numpy as np
+
+# Shares the profiling helpers of task-A (stage timers, counters and run reports) if they are importable
+try:
+    from instrument import add_profile_arguments, count, enable_profiling, finish_profiling, stage
+except ImportError:
+    # Without them stages and counters do nothing, and the command line has no profiling options
+    def stage(name):
+        return contextlib.nullcontext()
+
+    def count(name, amount=1):
+        pass
+
+    def enable_profiling(name, cprofile_path=None):
+        pass
+
+    def finish_profiling(report_path=None):
+        return None
+
+    def add_profile_arguments(parser):
+        parser.set_defaults(profile=None, cprofile=None)
+
+# File types picked up from an input directory
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".pgm")
+
+# Header of a binary 8-bit PGM file: magic number, width, height and maximum value, separated by whitespace or comments
+PGM_HEADER = re.compile(rb"P5(?:\s|#[^\n]*\n)+(\d+)(?:\s|#[^\n]*\n)+(\d+)(?:\s|#[^\n]*\n)+(\d+)\s")
+
+# Removes table regions from a binary image based on pixel density analysis
+def remove_table(binary_image, table_density_threshold=0.8):
+    height, width = binary_image.shape
+
+    # Count white pixels in each row to identify dense regions (likely tables)
+    horizontal_histogram = np.count_nonzero(binary_image == 255, axis=1)
+
+    # Identify rows that exceed the density threshold (probable table rows)
+    table_rows = np.where(horizontal_histogram > table_density_threshold * width)[0]
+
+    # Create a mask marking table regions
+    table_mask = np.zeros_like(binary_image)
+    if len(table_rows) > 0:
+        # Mark the entire region between first and last table row
+        table_mask[table_rows.min():table_rows.max(), :] = 255
+
+    # Remove table regions from the original image
+    non_table_image = cv2.bitwise_and(binary_image, cv2.bitwise_not(table_mask))
+    return non_table_image, table_mask
+
+# Finds the column boundaries from the number of text pixels in each column
+def find_columns(vertical_histogram, min_column_width=50):
+    # Find completely empty vertical spaces (potential column separators)
+    column_gaps = np.flatnonzero(vertical_histogram == 0)
+
+    # A column runs from one gap to the next when they are far enough apart (minimum column width)
+    prev_gaps = np.concatenate(([0], column_gaps[:-1]))
+    wide = column_gaps - prev_gaps > min_column_width
+    column_boundaries = list(zip(prev_gaps[wide].tolist(), column_gaps[wide].tolist()))
+
+    # Add the last column if it extends to the image edge
+    width = len(vertical_histogram)
+    prev_gap = int(column_gaps[-1]) if len(column_gaps) > 0 else 0
+    if prev_gap < width:
+        column_boundaries.append((prev_gap, width))
+    return column_boundaries
+
+# Finds the paragraphs from the number of text pixels in each row, as (top, bottom) rows padded by padding pixels
+# Paragraphs that overlap a row flagged in table_rows are skipped
+def find_paragraphs(horizontal_histogram, max_gap=30, table_rows=None, padding=30):
+    height = len(horizontal_histogram)
+    text_rows = np.flatnonzero(horizontal_histogram)
+    if len(text_rows) == 0:
+        return []
+
+    # A new paragraph starts wherever the gap to the previous text row is too large
+    breaks = np.flatnonzero(np.diff(text_rows) > max_gap)
+    tops = text_rows[np.concatenate(([0], breaks + 1))]
+    bottoms = text_rows[np.concatenate((breaks, [len(text_rows) - 1]))]
+
+    # Add padding to paragraph boundaries
+    tops = np.maximum(tops - padding, 0)
+    bottoms = np.minimum(bottoms + padding, height)
+
+    # Skip paragraphs that intersect with tables, counting table rows with a cumulative sum
+    if table_rows is not None:
+        table_rows_before = np.concatenate(([0], np.cumsum(table_rows)))
+        outside_tables = table_rows_before[bottoms] == table_rows_before[tops]
+        tops, bottoms = tops[outside_tables], bottoms[outside_tables]
+    return list(zip(tops.tolist(), bottoms.tolist()))
+
+# Integral image of the text pixels of a binary image: entry [y, x] counts the text pixels above and left of (y, x),
+# so the row or column profile of any rectangle is a difference of a few slices of it
+def projection_profiles(binary_image):
+    text = (binary_image == 255).view(np.uint8)
+    return cv2.integral(text, sdepth=cv2.CV_32S)
+
+# Text pixels in each row of the rectangle [top:bottom, left:right]
+def row_profile(integral, top, bottom, left, right):
+    row_sums = integral[top + 1:bottom + 1, [left, right]] - integral[top:bottom, [left, right]]
+    return row_sums[:, 1] - row_sums[:, 0]
+
+# Text pixels in each column of the rectangle [top:bottom, left:right]
+def column_profile(integral, top, bottom, left, right):
+    column_sums = integral[bottom, left:right + 1] - integral[top, left:right + 1]
+    return np.diff(column_sums)
+
+# Shrinks a binary image by an integer factor, marking a pixel as text if any pixel of its block is text
+def downscale_binary(binary_image, factor):
+    height, width = binary_image.shape
+    # Pads to whole blocks, so area interpolation averages exactly one block per pixel
+    padded = cv2.copyMakeBorder(binary_image, 0, -height % factor, 0, -width % factor, cv2.BORDER_CONSTANT, value=0)
+    small = cv2.resize(padded, (padded.shape[1] // factor, padded.shape[0] // factor), interpolation=cv2.INTER_AREA)
+    return cv2.threshold(small, 0, 255, cv2.THRESH_BINARY)[1]
+
+# Binarizes the rows [top:bottom] and columns [left:right] of the analysed page straight from the grayscale page,
+# shrinking them by scale like page_layout, so only that region is ever materialized
+def binary_region(image, top, bottom, left, right, scale=1):
+    region = image[top * scale:bottom * scale, left * scale:right * scale]
+    if region.size == 0:
+        return np.zeros((bottom - top, right - left), np.uint8)
+    _, binary_image = cv2.threshold(region, 127, 255, cv2.THRESH_BINARY_INV)
+    return downscale_binary(binary_image, scale) if scale > 1 else binary_image
+
+# Analysed rows per strip that keep the working memory of a strip within memory_budget_mb
+def band_rows_for_budget(page_width, memory_budget_mb, scale=1):
+    # A strip is held about three times over: thresholded, shrunk or blanked, and as a temporary count mask
+    page_rows = int(memory_budget_mb * 1024 * 1024) // (3 * max(page_width, 1))
+    return max(1, page_rows // scale)
+
+# Profiles of the whole binary page held in memory, read from its integral image
+# Returns (table_rows, height, width, row profile, column profile) of the analysed page, where the profiles are
+# functions of (top, bottom, left, right) like row_profile and column_profile
+def page_profiles(image, scale=1):
+    # Convert to binary image (white text on black background)
+    with stage("binarize"):
+        _, binary_image = cv2.threshold(image, 127, 255, cv2.THRESH_BINARY_INV)
+    if scale > 1:
+        with stage("downscale"):
+            binary_image = downscale_binary(binary_image, scale)
+
+    # Remove table regions
+    with stage("remove_table"):
+        non_table_image, table_mask = remove_table(binary_image)
+        # The table mask always covers whole rows
+        table_rows = table_mask[:, 0] == 255 if table_mask.shape[1] > 0 else None
+
+    # Every profile is read from the integral image instead of recounting pixels
+    with stage("projection_profiles"):
+        height, width = non_table_image.shape
+        profiles = projection_profiles(non_table_image)
+    return table_rows, height, width, partial(row_profile, profiles), partial(column_profile, profiles)
+
+# Profiles of the binary page computed strip by strip, so that only band_rows analysed rows of it exist at a time
+# Returns the same (table_rows, height, width, row profile, column profile) as page_profiles
+def strip_profiles(image, scale=1, band_rows=256):
+    page_height, page_width = image.shape
+    height, width = -(-page_height // scale), -(-page_width // scale)
+
+    # Binary strips of the rows [top:bottom] and columns [left:right], with the table rows blanked if known
+    def strips(top, bottom, left, right, table_rows=None):
+        for strip_top in range(top, bottom, band_rows):
+            strip_bottom = min(strip_top + band_rows, bottom)
+            strip = binary_region(image, strip_top, strip_bottom, left, right, scale)
+            if table_rows is not None:
+                strip[table_rows[strip_top:strip_bottom]] = 0
+            yield strip
+
+    # Finds the table rows as remove_table does, from the text pixels in every row of the page
+    with stage("remove_table"):
+        page_rows = np.concatenate([np.zeros(0, np.intp)] +
+                                   [np.count_nonzero(strip, axis=1) for strip in strips(0, height, 0, width)])
+        dense_rows = np.flatnonzero(page_rows > 0.8 * width)
+        table_rows = np.zeros(height, bool)
+        if len(dense_rows) > 0:
+            table_rows[dense_rows.min():dense_rows.max()] = True
+
+    # Whole column row profiles are kept, since the paragraph checks of a column read parts of them again
+    column_rows = {}
+
+    def strip_row_profile(top, bottom, left, right):
+        if (left, right) in column_rows:
+            return column_rows[left, right][top:bottom]
+        with stage("strip_profiles"):
+            profile = np.concatenate([np.zeros(0, np.intp)] + [np.count_nonzero(strip, axis=1)
+                                                                for strip in strips(top, bottom, left, right, table_rows)])
+        if top == 0 and bottom == height:
+            column_rows[left, right] = profile
+        return profile
+
+    def strip_column_profile(top, bottom, left, right):
+        profile = np.zeros(right - left, np.intp)
+        with stage("strip_profiles"):
+            for strip in strips(top, bottom, left, right, table_rows):
+                profile += np.count_nonzero(strip, axis=0)
+        return profile
+    return table_rows, height, width, strip_row_profile, strip_column_profile
+
+# Opens a page as a grayscale image. Binary 8-bit PGM pages are memory-mapped instead of read, so the strips of
+# very large scans only come from disk as they are analysed or cropped; other formats are decoded whole by OpenCV
+# Returns None if the image could not be read
+def load_page(image_path):
+    if image_path.lower().endswith(".pgm"):
+        with open(image_path, "rb") as pgm_file:
+            header = PGM_HEADER.match(pgm_file.read(1024))
+        if header is not None and int(header.group(3)) == 255:
+            width, height = int(header.group(1)), int(header.group(2))
+            return np.memmap(image_path, np.uint8, "r", header.end(), (height, width))
+    return cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+
+# Turns a page given as a path, encoded image bytes or a decoded (grayscale, BGR or BGRA) array into a grayscale
+# image. Arrays that are grayscale already are used as they are. Returns None if the page could not be decoded
+def decode_page(page):
+    if isinstance(page, np.ndarray):
+        if page.ndim == 3:
+            return cv2.cvtColor(page, cv2.COLOR_BGRA2GRAY if page.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+        return page
+    if isinstance(page, (bytes, bytearray, memoryview)):
+        return cv2.imdecode(np.frombuffer(page, np.uint8), cv2.IMREAD_GRAYSCALE)
+    return load_page(page)
+
+# Name of a page read from a file: the file name up to its first dot
+def page_name(image_path):
+    return image_path.replace('\\', '/').split('/')[-1].split('.')[0]
+
+# Analyses pages one at a time and yields the result of each page before reading the next one
+# pages holds paths, encoded image bytes or decoded arrays, or (name, page) pairs; pages that are not paths and
+# have no name are called page_1, page_2, ... by their position. reader turns a page into a grayscale image, or None
+# crops selects what comes with each paragraph: "view" (a view into the grayscale page, nothing is copied),
+# "binary" (the binarized crop that extract_paragraphs writes, cut when it is reached) or None (layouts only)
+# The layout is analysed as in page_layout with analysis_scale and memory_budget_mb
+# Yields {"name", "image" (the grayscale page), "layout", "paragraphs" ((file name, crop) pairs in reading order),
+#         "error" (None, or why the page could not be read, with image and layout None)}
+def iter_pages(pages, crops="view", analysis_scale=1, memory_budget_mb=None, reader=decode_page):
+    if crops not in ("view", "binary", None):
+        raise ValueError(f"Unknown crops {crops}. Use \"view\", \"binary\" or None.")
+    for page_number, page in enumerate(pages, 1):
+        name, source = page if isinstance(page, tuple) else (None, page)
+        if name is None:
+            name = page_name(source) if isinstance(source, str) else f"page_{page_number}"
+
+        # Load the image
+        with stage("read"):
+            image = reader(source)
+        if image is None:
+            error = f"Could not read the image at {source}" if isinstance(source, str) else f"Could not read {name}"
+            yield {"name": name, "image": None, "layout": None, "paragraphs": [], "error": error}
+            continue
+
+        layout = page_layout(image, name, analysis_scale, memory_budget_mb)
+        if isinstance(source, str):
+            layout["image"] = source
+        if crops == "view":
+            paragraphs = [(paragraph["file"], paragraph_view(image, paragraph)) for paragraph in layout["paragraphs"]]
+        elif crops == "binary":
+            paragraphs = paragraph_images(image, layout)
+        else:
+            paragraphs = []
+        yield {"name": name, "image": image, "layout": layout, "paragraphs": paragraphs, "error": None}
+
+# Main function to process multiple images, detecting and extracting paragraphs from columns.
+# The paragraph images are written to output_dir unless write_images is False, and the layout of every page is
+# saved as JSON in layout_dir if given. Returns the layouts of the pages that could be read (see page_layout)
+# With analysis_scale above 1 the layout is analysed on a page shrunk by that factor, and with memory_budget_mb
+# it is analysed strip by strip within that working memory (see page_layout)
+# reader and writer replace decode_page and cv2.imwrite, e.g. to read from and write to a store in memory;
+# writer(path, image) returns whether the image was written
+def extract_paragraphs(image_paths, output_dir="task-B/paragraphs", write_images=True, layout_dir=None,
+                       analysis_scale=1, memory_budget_mb=None, reader=decode_page, writer=cv2.imwrite):
+    layouts = []
+    # Paragraphs are cut out one at a time as they are written
+    for page in iter_pages(image_paths, "binary" if write_images else None, analysis_scale, memory_budget_mb, reader):
+        layout = page["layout"]
+        if layout is None:
+            print(page["error"])
+            continue
+
+        for output_name, paragraph_image in page["paragraphs"]:
+            with stage("write"):
+                writer(f"{output_dir}/{output_name}", paragraph_image)
+        if layout_dir is not None:
+            with stage("write"):
+                save_layout(layout, layout_dir)
+        count("paragraphs", len(layout["paragraphs"]))
+        count("pages")
+        layouts.append(layout)
+        # Print which image have how many columns detected
+        print(f"Processed {layout['name']} with {len(layout['columns']) - 1} columns detected.")
+    return layouts
+
+# Reads one page (a path, or a (name, path) pair) and analyses its layout, for a worker process of
+# extract_paragraphs_parallel
+# Returns the layout and, if with_images, the (output file name, paragraph image) pairs in reading order
+# The layout is None if the image could not be read
+def read_page(image_path, with_images=True, analysis_scale=1, memory_budget_mb=None, reader=decode_page):
+    page = next(iter_pages([image_path], "binary" if with_images else None, analysis_scale, memory_budget_mb, reader))
+    return page["layout"], list(page["paragraphs"])
+
+# Analyses the layout of a grayscale page without cutting out any image. Boxes are [x, y, width, height] on the page:
+# {"name", "width", "height",
+#  "tables": the row band removed as a table, if any, as [{"box"}],
+#  "columns": the padded columns, as [{"index", "box"}],
+#  "paragraphs": in reading order (column by column, top to bottom, sub-columns of very large paragraphs in turn),
+#                as [{"order", "column", "sub_column" (None outside large paragraphs), "index", "box", "file"}],
+#  "scale": the analysis scale}
+# With scale above 1 the analysis runs on a binary page shrunk by that factor, with every pixel threshold shrunk
+# to match, and the boxes are mapped back to the full page, so the crops still come from the full resolution page
+# (see compare_layouts for how close the boxes stay)
+# With memory_budget_mb the binary page is never held whole: it is read in strips that fit the budget, and the
+# profiles are added up strip by strip (see strip_profiles), giving the same layout with more passes over the page
+def page_layout(image, base_name, scale=1, memory_budget_mb=None):
+    if memory_budget_mb is None:
+        table_rows, height, width, page_row_profile, page_column_profile = page_profiles(image, scale)
+    else:
+        band_rows = band_rows_for_budget(image.shape[1], memory_budget_mb, scale)
+        table_rows, height, width, page_row_profile, page_column_profile = strip_profiles(image, scale, band_rows)
+
+    # Pixel thresholds of the full resolution analysis, shrunk with the page
+    padding = round(30 / scale)
+    max_gap = max(1, round(30 / scale))
+    min_column_width = max(1, round(50 / scale))
+    large_size = 700 / scale
+    small_size = 40 / scale
+
+    # Detect columns in the image
+    with stage("column_detection"):
+        column_boundaries = find_columns(page_column_profile(0, height, 0, width), min_column_width)
+
+    page_height, page_width = image.shape
+    layout = {"name": base_name, "width": page_width, "height": page_height, "tables": [], "columns": [],
+              "paragraphs": [], "scale": scale}
+
+    # Maps a box of the analysed page back to the full page
+    def page_box(left, top, right, bottom):
+        left, top = min(left * scale, page_width), min(top * scale, page_height)
+        return [left, top, min(right * scale, page_width) - left, min(bottom * scale, page_height) - top]
+
+    if table_rows is not None and table_rows.any():
+        table_row_indices = np.flatnonzero(table_rows)
+        layout["tables"].append({"box": page_box(0, int(table_row_indices[0]), width, int(table_row_indices[-1]) + 1)})
+
+    # Adds a paragraph in reading order
+    def add_paragraph(column, sub_column, index, left, top, right, bottom):
+        name = f"{base_name}_column_{column if sub_column is None else sub_column}_paragraph_{index}.png"
+        layout["paragraphs"].append({"order": len(layout["paragraphs"]) + 1, "column": column, "sub_column": sub_column,
+                                     "index": index, "box": page_box(left, top, right, bottom), "file": name})
+
+    # Process each detected column
+    for col_index, (start_col, end_col) in enumerate(column_boundaries):
+        # Extract column with padding
+        left, right = max(0, start_col - padding), min(width, end_col + padding)
+        layout["columns"].append({"index": col_index + 1, "box": page_box(left, 0, right, height)})
+
+        # Detect paragraphs within the column, checking them against the tables unless the
+        # (unclamped) table mask slice of the column is empty
+        column_table_rows = table_rows if len(range(width)[start_col - padding:end_col + padding]) > 0 else None
+        with stage("paragraph_detection"):
+            paragraphs = find_paragraphs(page_row_profile(0, height, left, right), max_gap, column_table_rows,
+                                         padding)
+
+        # Process each paragraph in the column
+        for index, (top, bottom) in enumerate(paragraphs):
+            paragraph_height, paragraph_width = bottom - top, right - left
+
+            # Ignore paragraphs that appear to be tables
+            if np.any(page_row_profile(top, bottom, left, right) > 0.8 * paragraph_width):
+                continue
+
+            # Special handling for very large paragraphs 700x700 (potentially consist of more than one paragraphs)
+            if paragraph_height > large_size and paragraph_width > large_size:
+                # Detect columns in the large paragraph
+                paragraph_columns = find_columns(page_column_profile(top, bottom, left, right), min_column_width)
+                # Process each detected sub-columns
+                for sub_col_index, (sub_start_col, sub_end_col) in enumerate(paragraph_columns):
+                    sub_left = left + max(0, sub_start_col - padding)
+                    sub_right = left + min(paragraph_width, sub_end_col + padding)
+                    # Detect paragraphs within the sub-column
+                    sub_paragraphs = find_paragraphs(page_row_profile(top, bottom, sub_left, sub_right), max_gap,
+                                                     padding=padding)
+                    # Process each paragraph in the sub-column
+                    for sub_index, (sub_top, sub_bottom) in enumerate(sub_paragraphs):
+                        # Ignore very small paragraphs 40x40 (probably just a full stop image)
+                        if sub_bottom - sub_top < small_size or sub_right - sub_left < small_size:
+                            continue
+                        add_paragraph(col_index + 1, sub_col_index + 1, sub_index + 1, sub_left, top + sub_top,
+                                      sub_right, top + sub_bottom)
+            else:
+                # Normal-sized paragraphs (paragraphs smaller than 700x700)
+                add_paragraph(col_index + 1, None, index + 1, left, top, right, bottom)
+    return layout
+
+# Cuts the paragraphs of a page out of the grayscale image on demand, using its layout
+# Yields (output file name, paragraph image) pairs in reading order, black text on white background
+def paragraph_images(image, layout):
+    for paragraph in layout["paragraphs"]:
+        with stage("crop"):
+            cropped = paragraph_image(image, layout, paragraph)
+        yield paragraph["file"], cropped
+
+# The paragraph region of the grayscale page, as a view without copying any pixel
+def paragraph_view(image, paragraph):
+    x, y, w, h = paragraph["box"]
+    return image[y:y + h, x:x + w]
+
+# Cuts one paragraph out of the grayscale page, binarized with the table rows blanked as during the analysis
+def paragraph_image(image, layout, paragraph):
+    x, y, w, h = paragraph["box"]
+    # Thresholding works pixel by pixel, so the crop can be binarized on its own
+    _, binary_paragraph = cv2.threshold(image[y:y + h, x:x + w], 127, 255, cv2.THRESH_BINARY_INV)
+    for table in layout["tables"]:
+        _, table_top, _, table_height = table["box"]
+        binary_paragraph[max(0, table_top - y):max(0, table_top + table_height - y)] = 0
+
+    # Invert colors for output (black text on white background)
+    return cv2.bitwise_not(binary_paragraph)
+
+# Saves the layout of a page as <layout_dir>/<page name>.json and returns the path
+def save_layout(layout, layout_dir):
+    layout_path = f"{layout_dir}/{layout['name']}.json"
+    with open(layout_path, "w") as layout_file:
+        json.dump(layout, layout_file, indent=2)
+    return layout_path
+
+# Overlap of two [x, y, width, height] boxes as intersection over union
+def box_iou(box_a, box_b):
+    ax, ay, aw, ah = box_a
+    bx, by, bw, bh = box_b
+    overlap_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    overlap_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    overlap = overlap_w * overlap_h
+    union = aw * ah + bw * bh - overlap
+    return overlap / union if union > 0 else 0.0
+
+# Compares the paragraph boxes of a layout with those of a reference layout of the same page (usually the
+# full resolution one), pairing each reference paragraph with the unused paragraph that overlaps it most
+# Returns {"reference", "candidate" (paragraph counts), "matched" (pairs with an IoU of at least min_iou),
+#          "mean_iou" and "max_offset" (largest box edge difference in pixels) over the matched pairs,
+#          "missing" and "extra" (file names of unmatched reference and candidate paragraphs)}
+def compare_layouts(reference, candidate, min_iou=0.5):
+    pairs = sorted(((box_iou(ref["box"], cand["box"]), ref_index, cand_index)
+                    for ref_index, ref in enumerate(reference["paragraphs"])
+                    for cand_index, cand in enumerate(candidate["paragraphs"])), reverse=True)
+    matched_refs, matched_cands, ious, offsets = set(), set(), [], []
+    for iou, ref_index, cand_index in pairs:
+        if iou < min_iou:
+            break
+        if ref_index in matched_refs or cand_index in matched_cands:
+            continue
+        matched_refs.add(ref_index)
+        matched_cands.add(cand_index)
+        ious.append(iou)
+        (rx, ry, rw, rh), (cx, cy, cw, ch) = reference["paragraphs"][ref_index]["box"], candidate["paragraphs"][cand_index]["box"]
+        offsets.append(max(abs(rx - cx), abs(ry - cy), abs(rx + rw - cx - cw), abs(ry + rh - cy - ch)))
+
+    return {"reference": len(reference["paragraphs"]), "candidate": len(candidate["paragraphs"]),
+            "matched": len(ious), "mean_iou": float(np.mean(ious)) if ious else 0.0,
+            "max_offset": max(offsets, default=0),
+            "missing": [paragraph["file"] for index, paragraph in enumerate(reference["paragraphs"])
+                        if index not in matched_refs],
+            "extra": [paragraph["file"] for index, paragraph in enumerate(candidate["paragraphs"])
+                      if index not in matched_cands]}
+
+# Analyses every page at full resolution and at analysis_scale and prints how well the boxes agree
+# Returns the comparison of every page that could be read (see compare_layouts)
+def check_fidelity(image_paths, analysis_scale, min_iou=0.5):
+    comparisons = []
+    for image_path in image_paths:
+        image = load_page(image_path)
+        if image is None:
+            print(f"Could not read the image at {image_path}")
+            continue
+        base_name = page_name(image_path)
+        comparison = compare_layouts(page_layout(image, base_name), page_layout(image, base_name, analysis_scale),
+                                     min_iou)
+        comparisons.append(comparison)
+        print(f"{base_name}: {comparison['matched']}/{comparison['reference']} paragraphs matched "
+              f"({comparison['candidate']} found), mean IoU {comparison['mean_iou']:.3f}, "
+              f"max edge offset {comparison['max_offset']} px")
+
+    reference = sum(comparison["reference"] for comparison in comparisons)
+    matched = sum(comparison["matched"] for comparison in comparisons)
+    print(f"Scale {analysis_scale}: {matched}/{reference} paragraphs matched at IoU >= {min_iou}.")
+    return comparisons
+
+# Extracts the paragraphs of many pages on a pool of worker processes, while a pool of threads writes the files
+# Yields one result per page as soon as its files are written, so in completion order rather than input order:
+# {"path", "name", "columns", "paragraphs" (written image paths), "layout", "error"}
+# File names only depend on the page name, so they are the same as with extract_paragraphs in any order
+# image_paths holds paths or (name, path) pairs as made by name_pages, which keeps pages from sharing a name
+# Without write_images only the small layouts travel back from the workers
+# reader and writer work as in extract_paragraphs, and reader has to be a module level function to reach the workers
+def extract_paragraphs_parallel(image_paths, output_dir="task-B/paragraphs", workers=None, io_threads=4,
+                                write_images=True, layout_dir=None, analysis_scale=1, memory_budget_mb=None,
+                                reader=decode_page, writer=cv2.imwrite):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # Bounds the pages held in memory between the workers and the writers
+    max_in_flight = 2 * workers
+
+    image_paths = iter(image_paths)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as page_pool, \
+            ThreadPoolExecutor(max_workers=io_threads) as write_pool:
+        analysing = {}
+        writing = []
+        while True:
+            while len(analysing) + len(writing) < max_in_flight:
+                named_path = next(image_paths, None)
+                if named_path is None:
+                    break
+                image_path = named_path[1] if isinstance(named_path, tuple) else named_path
+                analysing[page_pool.submit(read_page, named_path, write_images, analysis_scale,
+                                                 memory_budget_mb, reader)] = image_path
+            if not analysing and not writing:
+                break
+            wait(list(analysing) + [write for _, writes in writing for write in writes], return_when=FIRST_COMPLETED)
+
+            for future in [future for future in analysing if future.done()]:
+                image_path = analysing.pop(future)
+                page = {"path": image_path, "name": None, "columns": 0, "paragraphs": [], "layout": None, "error": None}
+                paragraphs = []
+                try:
+                    page["layout"], paragraphs = future.result()
+                except Exception as error:
+                    page["error"] = f"{type(error).__name__}: {error}"
+                if page["layout"] is None:
+                    page["error"] = page["error"] or f"Could not read the image at {image_path}"
+                    writing.append((page, []))
+                    continue
+                page["name"] = page["layout"]["name"]
+                page["columns"] = len(page["layout"]["columns"]) - 1
+
+                # A later paragraph with the same name replaces an earlier one, as when writing in order
+                unique = dict((f"{output_dir}/{output_name}", paragraph_image)
+                              for output_name, paragraph_image in paragraphs)
+                page["paragraphs"] = list(unique)
+                writes = [write_pool.submit(writer, output_path, paragraph_image)
+                          for output_path, paragraph_image in unique.items()]
+                if layout_dir is not None:
+                    writes.append(write_pool.submit(save_layout, page["layout"], layout_dir))
+                writing.append((page, writes))
+
+            for page, writes in [entry for entry in writing if all(write.done() for write in entry[1])]:
+                writing.remove((page, writes))
+                if page["error"] is None and not all(write.exception() is None and write.result() for write in writes):
+                    page["error"] = "Could not write every output file"
+                yield page
+
+# Expands files, directories (every image directly inside) and glob patterns into a sorted list of image paths
+def collect_image_paths(inputs):
+    image_paths = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            image_paths += sorted(os.path.join(pattern, name) for name in os.listdir(pattern)
+                                  if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            image_paths += sorted(glob.glob(pattern))
+    return image_paths
+
+# Pairs every image path with the name its output files get: the file name up to its first dot, or for pages whose
+# names would collide (001.png in two folders) the folder and the file name, e.g. scans-2024_001
+# Returns the (name, path) pairs, or None if two pages still end up with the same name
+def name_pages(image_paths):
+    names = [page_name(image_path) for image_path in image_paths]
+    duplicates = {name for name, pages in Counter(names).items() if pages > 1}
+    named_paths = [(f"{os.path.basename(os.path.dirname(os.path.abspath(image_path)))}_{name}"
+                    if name in duplicates else name, image_path)
+                   for name, image_path in zip(names, image_paths)]
+
+    duplicates = sorted(name for name, pages in Counter(name for name, _ in named_paths).items() if pages > 1)
+    if duplicates:
+        print(f"Error: Several pages would write their paragraphs as {', '.join(duplicates)}. "
+              "Rename them or process them separately.")
+        return None
+    return named_paths
+
+# Process images
+def process_images(output_dir="task-B/paragraphs", image_paths=None, workers=1, io_threads=4, write_images=True,
+                   layout_dir=None, analysis_scale=1, memory_budget_mb=None):
+    if image_paths is None:
+        image_paths = [
+            "task-B/project-files-B/001.png",
+            "task-B/project-files-B/002.png",
+            "task-B/project-files-B/003.png",
+            "task-B/project-files-B/004.png",
+            "task-B/project-files-B/005.png",
+            "task-B/project-files-B/006.png",
+            "task-B/project-files-B/007.png",
+            "task-B/project-files-B/008.png"
+            ]
+    if workers == 1:
+        extract_paragraphs(image_paths, output_dir, write_images, layout_dir, analysis_scale, memory_budget_mb)
+        return
+
+    # Prints each page as it completes
+    pages = extract_paragraphs_parallel(image_paths, output_dir, workers, io_threads, write_images, layout_dir,
+                                        analysis_scale, memory_budget_mb)
+    for page_number, page in enumerate(pages, 1):
+        if page["error"] is not None:
+            print(f"[{page_number}/{len(image_paths)}] {page['error']}")
+            continue
+        count("pages")
+        count("paragraphs", len(page["layout"]["paragraphs"]))
+        print(f"[{page_number}/{len(image_paths)}] Processed {page['name']} with {page['columns']} columns detected, "
+              f"{len(page['layout']['paragraphs'])} paragraphs found.")
+
+# Command line entry point, e.g.
+# python task-B/task-B.py --profile task-B/profile.json
+# python task-B/task-B.py "scans/*.png" --output-dir out --workers 8
+# python task-B/task-B.py scans --layout-dir layouts --no-images
+# python task-B/task-B.py scans --analysis-scale 4 --check-fidelity
+# python task-B/task-B.py newspaper.pgm --memory-budget 64
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract the paragraphs of the task-B pages as images.")
+    parser.add_argument("inputs", nargs="*", help="image files, directories or glob patterns (default: the task-B pages)")
+    parser.add_argument("--output-dir", default="task-B/paragraphs", help="folder for the paragraph images")
+    parser.add_argument("--layout-dir", default=None, help="save the layout of every page as JSON in this folder")
+    parser.add_argument("--no-images", action="store_true", help="do not write the paragraph images")
+    parser.add_argument("--workers", type=int, default=1, help="processes analysing pages (default: 1, no pool)")
+    parser.add_argument("--io-threads", type=int, default=4, help="threads writing output files in parallel mode")
+    parser.add_argument("--analysis-scale", type=int, default=1, metavar="F",
+                        help="find the layout on pages shrunk by F, still cropping at full resolution")
+    parser.add_argument("--check-fidelity", action="store_true",
+                        help="only compare the layouts found with --analysis-scale against full resolution")
+    parser.add_argument("--memory-budget", type=float, default=None, metavar="MB",
+                        help="analyse each page in strips using about MB of working memory (binary PGM pages are "
+                             "memory-mapped instead of read whole)")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.analysis_scale < 1:
+        print("Error: The analysis scale must be at least 1.")
+        return
+    if args.memory_budget is not None and args.memory_budget <= 0:
+        print("Error: The memory budget must be positive.")
+        return
+
+    image_paths = None
+    if args.inputs:
+        image_paths = collect_image_paths(args.inputs)
+        if not image_paths:
+            print("Error: No images found for the given inputs.")
+            return
+    if args.check_fidelity:
+        check_fidelity(image_paths or sorted(glob.glob("task-B/project-files-B/*.png")), args.analysis_scale)
+        return
+    # Pages with the same file name in different folders would overwrite each other's paragraphs
+    if image_paths is not None:
+        image_paths = name_pages(image_paths)
+        if image_paths is None:
+            return
+    if not args.no_images:
+        os.makedirs(args.output_dir, exist_ok=True)
+    if args.layout_dir is not None:
+        os.makedirs(args.layout_dir, exist_ok=True)
+
+    if args.profile is not None or args.cprofile is not None:
+        enable_profiling("task-B paragraphs", args.cprofile)
+    try:
+        process_images(args.output_dir, image_paths, args.workers, args.io_threads, not args.no_images, args.layout_dir,
+                       args.analysis_scale, args.memory_budget)
+    finally:
+        finish_profiling(args.profile)
+
+if __name__ == "__main__":
+    main()